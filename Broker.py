@@ -0,0 +1,554 @@
+import math
+import time
+import zlib
+
+from Packets import (
+    PUBLISH, SUBSCRIBE, UNSUBSCRIBE, ProtocolError, PublishTemplate, ReasonCode, Subscription, find_message_expiry,
+    patch_message_expiry
+)
+from Timers import ExpiryIndex
+
+
+class Match:
+    __slots__ = ('QoS', 'RAP', 'subscriptionIdentifiers')
+
+    def __init__(self, qos: int = 0, rap: bool = False, subscription_identifiers: tuple = ()):
+        self.QoS = qos
+        self.RAP = rap
+        self.subscriptionIdentifiers = subscription_identifiers
+
+
+class _TopicNode:
+    __slots__ = ('children', 'subscribers')
+
+    def __init__(self):
+        self.children = {}
+        self.subscribers = {}
+
+
+class SubscriptionTrie:
+    def __init__(self):
+        self._root = _TopicNode()
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def subscribe(self, client, subscription: Subscription, subscription_identifier: int = None) -> bool:
+        if not valid_topic_filter(subscription.topic):
+            raise ProtocolError(ReasonCode.TOPIC_FILTER_INVALID)
+
+        node = self._root
+        for level in subscription.topic.split('/'):
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = _TopicNode()
+            node = child
+
+        existed = client in node.subscribers
+        node.subscribers[client] = (subscription, subscription_identifier)
+        if not existed:
+            self._count += 1
+        return not existed
+
+    def unsubscribe(self, client, topic_filter: str) -> bool:
+        path = [self._root]
+        levels = topic_filter.split('/')
+        for level in levels:
+            child = path[-1].children.get(level)
+            if child is None:
+                return False
+            path.append(child)
+
+        if path[-1].subscribers.pop(client, None) is None:
+            return False
+        self._count -= 1
+
+        # prune the branch back to the last node that is still in use
+        for index in range(len(levels), 0, -1):
+            node = path[index]
+            if node.subscribers or node.children:
+                break
+            del path[index - 1].children[levels[index - 1]]
+        return True
+
+    def subscribe_packet(
+            self, client, packet: SUBSCRIBE, maximum_qos: int = 2, shared: 'SharedSubscriptions' = None
+    ) -> tuple:
+        # No Local on a Shared Subscription makes the whole packet a Protocol Error, checked before any filter applies
+        if shared is not None and any(
+                subscription.NL and subscription.topic.startswith(SHARE_PREFIX) for subscription in packet.subscriptions
+        ):
+            raise ProtocolError(ReasonCode.PROTOCOL_ERROR)
+
+        reason_codes = []
+        for subscription in packet.subscriptions:
+            if subscription.topic.startswith(SHARE_PREFIX):
+                if shared is None:
+                    reason_codes.append(ReasonCode.SHARED_SUBSCRIPTIONS_NOT_SUPPORTED)
+                    continue
+                if parse_shared_subscription(subscription.topic) is None:
+                    reason_codes.append(ReasonCode.TOPIC_FILTER_INVALID)
+                    continue
+                subscription = _limit_qos(subscription, maximum_qos)
+                shared.subscribe(client, subscription, packet.subscriptionIdentifier)
+                reason_codes.append(subscription.QoS)
+                continue
+
+            if not valid_topic_filter(subscription.topic):
+                reason_codes.append(ReasonCode.TOPIC_FILTER_INVALID)
+                continue
+            subscription = _limit_qos(subscription, maximum_qos)
+            self.subscribe(client, subscription, packet.subscriptionIdentifier)
+            reason_codes.append(subscription.QoS)
+        return tuple(reason_codes)
+
+    def unsubscribe_packet(self, client, packet: UNSUBSCRIBE, shared: 'SharedSubscriptions' = None) -> tuple:
+        reason_codes = []
+        for topic in packet.topics:
+            if topic.startswith(SHARE_PREFIX) and shared is not None:
+                removed = shared.unsubscribe(client, topic)
+            else:
+                removed = self.unsubscribe(client, topic)
+            reason_codes.append(ReasonCode.SUCCESS if removed else ReasonCode.NO_SUBSCRIPTION_EXISTED)
+        return tuple(reason_codes)
+
+    def match(self, topic: str, publisher=None) -> dict:
+        levels = topic.split('/')
+        depth = len(levels)
+        result = {}
+
+        # wildcards at the first level do not match topics starting with $
+        system = topic.startswith('$')
+        stack = [(self._root, 0)]
+        while stack:
+            node, index = stack.pop()
+            children = node.children
+
+            if not (system and index == 0):
+                child = children.get('#')
+                if child is not None:
+                    self._collect(child, publisher, result)
+
+            if index == depth:
+                self._collect(node, publisher, result)
+                continue
+
+            child = children.get(levels[index])
+            if child is not None:
+                stack.append((child, index + 1))
+            if not (system and index == 0):
+                child = children.get('+')
+                if child is not None:
+                    stack.append((child, index + 1))
+
+        return result
+
+    @staticmethod
+    def _collect(node: _TopicNode, publisher, result: dict):
+        for client, (subscription, subscription_identifier) in node.subscribers.items():
+            if subscription.NL and client == publisher:
+                continue
+
+            match = result.get(client)
+            if match is None:
+                result[client] = Match(
+                    subscription.QoS, subscription.RAP,
+                    (subscription_identifier,) if subscription_identifier is not None else ()
+                )
+                continue
+
+            # overlapping subscriptions are delivered once with the maximum QoS
+            if subscription.QoS > match.QoS:
+                match.QoS = subscription.QoS
+            match.RAP = match.RAP or subscription.RAP
+            if subscription_identifier is not None:
+                match.subscriptionIdentifiers += (subscription_identifier,)
+
+
+class Retained:
+    __slots__ = ('topic', 'template', 'QoS', 'expiry', 'expiryOffset')
+
+    def __init__(self, topic: str, template: PublishTemplate, qos: int, expiry: float = None):
+        self.topic = topic
+        self.template = template
+        self.QoS = qos
+        self.expiry = expiry
+
+        # the Message Expiry Interval counted back from the payload, the same in every encoding of the template
+        self.expiryOffset = None
+        if expiry is not None:
+            frame = template.encode()
+            self.expiryOffset = len(frame) - len(template.payload) - find_message_expiry(frame)
+
+
+class _RetainedNode:
+    __slots__ = ('children', 'message')
+
+    def __init__(self):
+        self.children = {}
+        self.message = None
+
+
+class RetainedStore:
+    def __init__(self, clock=time.monotonic):
+        self._root = _RetainedNode()
+        self._count = 0
+        self._clock = clock
+        self._expiry = ExpiryIndex()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def retain(self, packet: PUBLISH) -> bool:
+        # topic aliases must be resolved before the frame is shared with other sessions
+        if not packet.topic or packet.topicAlias is not None:
+            raise ProtocolError(ReasonCode.PROTOCOL_ERROR)
+
+        if not packet.payload:
+            return self.remove(packet.topic)
+
+        expiry = None
+        if packet.messageExpiryInterval is not None:
+            expiry = self._clock() + packet.messageExpiryInterval
+
+        node = self._root
+        for level in packet.topic.split('/'):
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = _RetainedNode()
+            node = child
+
+        if node.message is None:
+            self._count += 1
+        # the publisher's DUP flag and packet identifier are set per delivery, not stored
+        template = PublishTemplate(packet)
+        if isinstance(template.payload, memoryview):
+            # a zero-copy payload is a view on the receive buffer
+            template.payload = bytes(template.payload)
+        node.message = Retained(packet.topic, template, packet.QoS, expiry)
+        if expiry is not None:
+            self._expiry.add(packet.topic, expiry)
+        return True
+
+    def remove(self, topic: str) -> bool:
+        path = [self._root]
+        levels = topic.split('/')
+        for level in levels:
+            child = path[-1].children.get(level)
+            if child is None:
+                return False
+            path.append(child)
+
+        if path[-1].message is None:
+            return False
+        path[-1].message = None
+        self._count -= 1
+
+        # prune the branch back to the last node that is still in use
+        for index in range(len(levels), 0, -1):
+            node = path[index]
+            if node.message is not None or node.children:
+                break
+            del path[index - 1].children[levels[index - 1]]
+        return True
+
+    def get(self, topic: str) -> Retained | None:
+        node = self._root
+        for level in topic.split('/'):
+            node = node.children.get(level)
+            if node is None:
+                return None
+
+        message = node.message
+        if message is not None and message.expiry is not None and message.expiry <= self._clock():
+            self.remove(topic)
+            return None
+        return message
+
+    def match(self, topic_filter: str) -> list:
+        levels = topic_filter.split('/')
+        depth = len(levels)
+        found = []
+
+        stack = [(self._root, 0)]
+        while stack:
+            node, index = stack.pop()
+            if index == depth:
+                if node.message is not None:
+                    found.append(node.message)
+                continue
+
+            level = levels[index]
+            if level == '#':
+                # '#' also matches the parent level itself
+                if node.message is not None:
+                    found.append(node.message)
+                self._collect(node, index == 0, found)
+            elif level == '+':
+                for name, child in node.children.items():
+                    # wildcards at the first level do not match topics starting with $
+                    if not (index == 0 and name.startswith('$')):
+                        stack.append((child, index + 1))
+            else:
+                child = node.children.get(level)
+                if child is not None:
+                    stack.append((child, index + 1))
+
+        # expired messages are dropped lazily, when a lookup reaches them
+        now = self._clock()
+        expired = [message for message in found if message.expiry is not None and message.expiry <= now]
+        for message in expired:
+            self.remove(message.topic)
+        return [message for message in found if message.expiry is None or message.expiry > now] if expired else found
+
+    def match_subscription(self, subscription: Subscription, new: bool = True) -> list:
+        # Retain Handling 0 sends on every subscribe, 1 only for new subscriptions, 2 never
+        if subscription.retainHandling == 2 or (subscription.retainHandling == 1 and not new):
+            return []
+        # retained messages are not sent for shared subscriptions
+        if subscription.topic.startswith(SHARE_PREFIX):
+            return []
+        return self.match(subscription.topic)
+
+    def expire(self) -> int:
+        # only topics whose deadline has passed are visited, a topic retained again since is kept
+        now = self._clock()
+        count = 0
+        for topic in self._expiry.expire(now):
+            node = self._root
+            for level in topic.split('/'):
+                node = node.children.get(level)
+                if node is None:
+                    break
+            else:
+                message = node.message
+                if message is not None and message.expiry is not None and message.expiry <= now:
+                    self.remove(topic)
+                    count += 1
+        return count
+
+    def frame(
+            self, message: Retained, packet_identifier: int = 0, qos: int = None, subscription_identifiers: tuple = ()
+    ) -> bytearray:
+        # delivered at the lower of the subscription's and the message's QoS, with RETAIN set
+        qos = message.QoS if qos is None else min(qos, message.QoS)
+        frame = message.template.encode(packet_identifier, qos, False, True, subscription_identifiers)
+
+        # the interval sent on is what remains of it
+        if message.expiryOffset is not None:
+            position = len(frame) - len(message.template.payload) - message.expiryOffset
+            patch_message_expiry(frame, position, max(0, math.ceil(message.expiry - self._clock())))
+        return frame
+
+    @staticmethod
+    def _collect(node: _RetainedNode, root: bool, found: list):
+        stack = [
+            child for name, child in node.children.items() if not (root and name.startswith('$'))
+        ]
+        while stack:
+            node = stack.pop()
+            if node.message is not None:
+                found.append(node.message)
+            stack.extend(node.children.values())
+
+
+class RoundRobin:
+    __slots__ = ('_members', '_index', '_next')
+
+    def __init__(self):
+        self._members = []
+        self._index = {}
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def add(self, client):
+        if client not in self._index:
+            self._index[client] = len(self._members)
+            self._members.append(client)
+
+    def remove(self, client):
+        # swap with the last member so removal does not shift the list
+        index = self._index.pop(client)
+        last = self._members.pop()
+        if index < len(self._members):
+            self._members[index] = last
+            self._index[last] = index
+
+    def select(self, topic: str):
+        if self._next >= len(self._members):
+            self._next = 0
+        client = self._members[self._next]
+        self._next += 1
+        return client
+
+    def complete(self, client):
+        pass
+
+
+class HashByTopic(RoundRobin):
+    __slots__ = ()
+
+    def select(self, topic: str):
+        # stable across processes, unlike hash(); changes in membership remap topics
+        return self._members[zlib.crc32(topic.encode()) % len(self._members)]
+
+
+class LeastInflight:
+    __slots__ = ('_inflight', '_buckets', '_minimum')
+
+    def __init__(self):
+        # members grouped by inflight count, so the least loaded one is found without a scan
+        self._inflight = {}
+        self._buckets = {}
+        self._minimum = 0
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def add(self, client):
+        if client not in self._inflight:
+            self._inflight[client] = 0
+            self._buckets.setdefault(0, {})[client] = None
+            self._minimum = 0
+
+    def remove(self, client):
+        count = self._inflight.pop(client)
+        self._discard(client, count)
+        if count == self._minimum and count not in self._buckets:
+            self._minimum = min(self._buckets, default=0)
+
+    def select(self, topic: str):
+        client = next(iter(self._buckets[self._minimum]))
+        count = self._inflight[client]
+        self._discard(client, count)
+        self._inflight[client] = count + 1
+        self._buckets.setdefault(count + 1, {})[client] = None
+        if count not in self._buckets:
+            self._minimum = count + 1
+        return client
+
+    def complete(self, client):
+        count = self._inflight.get(client)
+        if not count:
+            return
+        self._discard(client, count)
+        self._inflight[client] = count - 1
+        self._buckets.setdefault(count - 1, {})[client] = None
+        if count - 1 < self._minimum:
+            self._minimum = count - 1
+
+    def _discard(self, client, count: int):
+        bucket = self._buckets[count]
+        del bucket[client]
+        if not bucket:
+            del self._buckets[count]
+
+
+class SharedGroup:
+    __slots__ = ('shareName', 'topicFilter', 'members', 'policy')
+
+    def __init__(self, share_name: str, topic_filter: str, policy):
+        self.shareName = share_name
+        self.topicFilter = topic_filter
+
+        # client -> (subscription, subscription identifier)
+        self.members = {}
+        self.policy = policy
+
+    def complete(self, client):
+        if client in self.members:
+            self.policy.complete(client)
+
+
+class SharedSubscriptions:
+    def __init__(self, policy=RoundRobin):
+        self._policy = policy
+        self._groups = {}
+        self._trie = SubscriptionTrie()
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def subscribe(self, client, subscription: Subscription, subscription_identifier: int = None) -> bool:
+        shared = parse_shared_subscription(subscription.topic)
+        if shared is None:
+            raise ProtocolError(ReasonCode.TOPIC_FILTER_INVALID)
+        if subscription.NL:
+            raise ProtocolError(ReasonCode.PROTOCOL_ERROR)
+
+        group = self._groups.get(shared)
+        if group is None:
+            group = self._groups[shared] = SharedGroup(*shared, self._policy())
+            self._trie.subscribe(shared, Subscription(shared[1]))
+
+        existed = client in group.members
+        group.members[client] = (subscription, subscription_identifier)
+        group.policy.add(client)
+        return not existed
+
+    def unsubscribe(self, client, topic_filter: str) -> bool:
+        shared = parse_shared_subscription(topic_filter)
+        group = self._groups.get(shared)
+        if group is None or group.members.pop(client, None) is None:
+            return False
+
+        group.policy.remove(client)
+        if not group.members:
+            del self._groups[shared]
+            self._trie.unsubscribe(shared, shared[1])
+        return True
+
+    def group(self, share_name: str, topic_filter: str) -> SharedGroup | None:
+        return self._groups.get((share_name, topic_filter))
+
+    def dispatch(self, topic: str) -> list:
+        deliveries = []
+        for shared in self._trie.match(topic):
+            group = self._groups[shared]
+            client = group.policy.select(topic)
+            subscription, subscription_identifier = group.members[client]
+            deliveries.append((
+                group, client,
+                Match(
+                    subscription.QoS, subscription.RAP,
+                    (subscription_identifier,) if subscription_identifier is not None else ()
+                )
+            ))
+        return deliveries
+
+
+SHARE_PREFIX = '$share/'
+
+
+def parse_shared_subscription(topic_filter: str) -> tuple | None:
+    if not topic_filter.startswith(SHARE_PREFIX):
+        return None
+    share_name, separator, shared_filter = topic_filter[len(SHARE_PREFIX):].partition('/')
+    if not share_name or not separator or '+' in share_name or '#' in share_name:
+        return None
+    if not valid_topic_filter(shared_filter):
+        return None
+    return share_name, shared_filter
+
+
+def _limit_qos(subscription: Subscription, maximum_qos: int) -> Subscription:
+    if subscription.QoS <= maximum_qos:
+        return subscription
+    return Subscription(
+        subscription.topic, maximum_qos, subscription.NL, subscription.RAP, subscription.retainHandling
+    )
+
+
+def valid_topic_filter(topic_filter: str) -> bool:
+    if topic_filter == '':
+        return False
+    levels = topic_filter.split('/')
+    for index, level in enumerate(levels):
+        if '#' in level and (level != '#' or index != len(levels) - 1):
+            return False
+        if '+' in level and level != '+':
+            return False
+    return True
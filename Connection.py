@@ -0,0 +1,284 @@
+from Packets import (
+    CONNACK, CONNECT, DISCONNECT, PINGREQ, PINGRESP, PUBLISH, SUBSCRIBE, UNSUBSCRIBE, MalformedPacket, PacketTooLarge,
+    ProtocolError, ReasonCode, StreamDecoder, TopicCache, Type, encode, encoded_size
+)
+from Session import Inflight, TopicAliases
+
+
+class Role:
+    CLIENT = 0
+    SERVER = 1
+
+
+class State:
+    CONNECTING = 0
+    CONNECTED = 1
+    CLOSED = 2
+
+
+class Connection:
+    def __init__(self, role: int, inflight: Inflight = None, topic_cache: TopicCache = None):
+        self.role = role
+        self.state = State.CONNECTING
+        self.topicCache = topic_cache
+
+        # an Inflight from an earlier connection resumes its session
+        self.inflight = inflight if inflight is not None else Inflight()
+        self.aliases = TopicAliases()
+
+        # negotiated by CONNECT and CONNACK
+        self.clientID = None
+        self.keepAlive = 0
+        self.maximumPacketSize = None
+
+        self._decoder = StreamDecoder(topic_cache=topic_cache)
+        self._output = bytearray()
+        self._connect = None
+        self._held = []
+        self._requests = {}
+
+    def receive_data(self, data: bytes | bytearray | memoryview) -> list:
+        if self.state == State.CLOSED:
+            return []
+        try:
+            packets = self._decoder.feed(data)
+        except MalformedPacket:
+            self._fail(ReasonCode.MALFORMED_PACKET)
+            raise
+        return self._process(packets)
+
+    def data_to_send(self) -> bytearray:
+        data, self._output = self._output, bytearray()
+        return data
+
+    def send_connect(self, packet: CONNECT):
+        self._expect(Role.CLIENT, State.CONNECTING)
+        self._connect = packet
+        self.clientID = packet.clientID
+        self.keepAlive = packet.keepAlive
+
+        # limits we announce apply to what the server sends
+        self.inflight.inboundMaximum = packet.receiveMaximum or 65535
+        self.aliases.inboundMaximum = packet.topicAliasMaximum or 0
+        self._queue(packet)
+
+    def send_connack(self, packet: CONNACK) -> list:
+        self._expect(Role.SERVER, State.CONNECTING)
+        if self._connect is None:
+            raise ProtocolError(ReasonCode.PROTOCOL_ERROR)
+
+        self.inflight.inboundMaximum = packet.receiveMaximum or 65535
+        self.aliases.inboundMaximum = packet.topicAliasMaximum or 0
+        if packet.serverKeepAlive is not None:
+            self.keepAlive = packet.serverKeepAlive
+        if packet.assignedClientIdentifier is not None:
+            self.clientID = packet.assignedClientIdentifier
+        self._queue(packet)
+
+        held, self._held = self._held, []
+        if packet.reasonCode >= ReasonCode.UNSPECIFIED_ERROR:
+            self.state = State.CLOSED
+            return []
+        self.state = State.CONNECTED
+        self._resume(packet.sessionPresent)
+
+        # the events of packets the client sent before the CONNACK
+        return self._process(held)
+
+    def send_publish(self, packet: PUBLISH) -> bool:
+        self._expect(None, State.CONNECTED)
+
+        # a PUBLISH over the peer's Maximum Packet Size is never sent, nor given an identifier
+        if not self._fits(packet):
+            raise PacketTooLarge
+
+        # over the peer's Receive Maximum the PUBLISH is sent once an acknowledgement frees the window
+        if self.inflight.publish(packet) is None:
+            return False
+        self._queue_publish(packet)
+        return True
+
+    def send_subscribe(self, packet: SUBSCRIBE):
+        self._send_request(packet)
+
+    def send_unsubscribe(self, packet: UNSUBSCRIBE):
+        self._send_request(packet)
+
+    def send_ping(self):
+        self._expect(Role.CLIENT, State.CONNECTED)
+        self._queue(PINGREQ())
+
+    def send_disconnect(self, packet: DISCONNECT = None):
+        self._expect(None, State.CONNECTED)
+        self._queue(packet if packet is not None else DISCONNECT())
+        self.state = State.CLOSED
+
+    def send_packet(self, packet):
+        # SUBACK, UNSUBACK and AUTH, which need no connection state
+        self._expect(None, State.CONNECTED)
+        self._queue(packet)
+
+    def _process(self, packets) -> list:
+        events = []
+        try:
+            for packet in packets:
+                if self._receive(packet):
+                    events.append(packet)
+                # nothing after a DISCONNECT is acted on
+                if self.state == State.CLOSED:
+                    break
+        except MalformedPacket:
+            self._fail(ReasonCode.MALFORMED_PACKET)
+            raise
+        except PacketTooLarge:
+            # a packet of ours the peer would not accept, not an error of the peer
+            raise
+        except ProtocolError as error:
+            self._fail(error.reasonCode)
+            raise
+        return events
+
+    def _receive(self, packet) -> bool:
+        if self.state == State.CONNECTING:
+            # the client need not wait for the CONNACK, what it sends after CONNECT is handled once it is sent
+            if self.role == Role.SERVER and self._connect is not None and packet.type != Type.AUTH:
+                self._held.append(packet)
+                return False
+
+            # AUTH only continues an exchange that a CONNECT has started
+            expected = Type.CONNECT if self.role == Role.SERVER else Type.CONNACK
+            if packet.type != expected and (packet.type != Type.AUTH or self._connect is None):
+                raise ProtocolError(ReasonCode.PROTOCOL_ERROR)
+
+        match packet.type:
+            case Type.CONNECT | Type.CONNACK if self.state != State.CONNECTING:
+                # each is sent once per connection
+                raise ProtocolError(ReasonCode.PROTOCOL_ERROR)
+
+            case Type.CONNECT:
+                self._connect = packet
+                self.clientID = packet.clientID
+                self.keepAlive = packet.keepAlive
+                self._negotiate(packet)
+
+            case Type.CONNACK:
+                if packet.reasonCode >= ReasonCode.UNSPECIFIED_ERROR:
+                    self.state = State.CLOSED
+                    return True
+                self.state = State.CONNECTED
+                self._negotiate(packet)
+                if packet.serverKeepAlive is not None:
+                    self.keepAlive = packet.serverKeepAlive
+                if packet.assignedClientIdentifier is not None:
+                    self.clientID = packet.assignedClientIdentifier
+                self._resume(packet.sessionPresent)
+
+            case Type.PUBLISH:
+                self.aliases.inbound(packet)
+                deliver, response = self.inflight.receive(packet)
+                if response is not None:
+                    self._queue(response)
+                return deliver
+
+            case Type.PUBACK | Type.PUBREC | Type.PUBCOMP:
+                self._queue_all(self.inflight.acknowledge(packet))
+
+            case Type.PUBREL:
+                self._queue(self.inflight.release(packet))
+                return False
+
+            case Type.SUBACK | Type.UNSUBACK:
+                if self._requests.pop(packet.packetIdentifier, None) is not None:
+                    self.inflight.identifiers.release(packet.packetIdentifier)
+
+            case Type.PINGREQ:
+                if self.role != Role.SERVER:
+                    raise ProtocolError(ReasonCode.PROTOCOL_ERROR)
+                self._queue(PINGRESP())
+                return False
+
+            case Type.PINGRESP:
+                return False
+
+            case Type.DISCONNECT:
+                self.state = State.CLOSED
+
+        return True
+
+    def _negotiate(self, packet: CONNECT | CONNACK):
+        # limits the peer announces apply to what we send
+        self.inflight.receiveMaximum = packet.receiveMaximum or 65535
+        self.maximumPacketSize = packet.maximumPacketSize
+        self.aliases.outboundMaximum = packet.topicAliasMaximum or 0
+
+    def _resume(self, session_present: bool):
+        if not session_present:
+            self.inflight = Inflight(self.inflight.receiveMaximum, self.inflight.inboundMaximum)
+            return
+        self._queue_all(self.inflight.retransmit())
+
+    def _send_request(self, packet: SUBSCRIBE | UNSUBSCRIBE):
+        self._expect(Role.CLIENT, State.CONNECTED)
+        allocated = packet.packetIdentifier == 0
+        if allocated:
+            packet.packetIdentifier = self.inflight.identifiers.allocate()
+            self._requests[packet.packetIdentifier] = packet
+        try:
+            self._queue(packet)
+        except PacketTooLarge:
+            # never sent, so no SUBACK or UNSUBACK will free the identifier
+            if allocated:
+                del self._requests[packet.packetIdentifier]
+                self.inflight.identifiers.release(packet.packetIdentifier)
+                packet.packetIdentifier = 0
+            raise
+
+    def _queue_publish(self, packet: PUBLISH):
+        # the alias only applies to this frame, the Inflight copy keeps its topic for retransmission
+        topic, alias = packet.topic, packet.topicAlias
+        self.aliases.outbound(packet)
+        try:
+            self._queue(packet)
+        finally:
+            packet.topic, packet.topicAlias = topic, alias
+
+    def _queue_all(self, packets: list):
+        index = 0
+        while index < len(packets):
+            packet = packets[index]
+            index += 1
+            if packet.type != Type.PUBLISH:
+                self._queue(packet)
+            elif self._fits(packet):
+                self._queue_publish(packet)
+            else:
+                # dropped as in send_publish, the next PUBLISH waiting takes its place
+                packets += self.inflight.discard(packet.packetIdentifier)
+
+    def _fits(self, packet: PUBLISH) -> bool:
+        if self.maximumPacketSize is None:
+            return True
+
+        # measured in its largest form, with the topic and a Topic Alias
+        alias = packet.topicAlias
+        if self.aliases.outboundMaximum > 0:
+            packet.topicAlias = 1
+        try:
+            return encoded_size(packet) <= self.maximumPacketSize
+        finally:
+            packet.topicAlias = alias
+
+    def _queue(self, packet):
+        self._output += encode(packet, self.topicCache, self.maximumPacketSize, trim=True)
+
+    def _expect(self, role: int | None, state: int):
+        if (role is not None and self.role != role) or self.state != state:
+            raise ProtocolError(ReasonCode.PROTOCOL_ERROR)
+
+    def _fail(self, reason_code: int):
+        # before CONNACK the server reports the error in the CONNACK itself
+        if self.role == Role.SERVER and self.state == State.CONNECTING:
+            self._output += encode(CONNACK(reason_code))
+        elif self.state == State.CONNECTED:
+            self._output += encode(DISCONNECT(reason_code))
+        self.state = State.CLOSED
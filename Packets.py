@@ -1,5 +1,10 @@
+import struct
+import sys
+from collections import OrderedDict
+
 PROTOCOL_NAME: str = 'MQTT'
 PROTOCOL_VERSION: int = 5
+MAXIMUM_PACKET_SIZE: int = 268435460
 
 
 class Type:
@@ -50,6 +55,7 @@ class ReasonCode:
     TOPIC_NAME_INVALID = 144
     PACKET_IDENTIFIER_IN_USE = 145
     PACKET_IDENTIFIER_NOT_FOUND = 146
+    RECEIVE_MAXIMUM_EXCEEDED = 147
     TOPIC_ALIAS_INVALID = 148
     PACKET_TOO_LARGE = 149
     MESSAGE_RATE_TOO_HIGH = 150
@@ -67,7 +73,172 @@ class ReasonCode:
     WILDCARD_SUBSCRIPTIONS_NOT_SUPPORTED = 162
 
 
+class TopicCache:
+    __slots__ = ('capacity', 'hits', 'misses', 'evictions', '_encoded', '_decoded')
+
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._encoded = OrderedDict()
+        self._decoded = OrderedDict()
+
+    def encode(self, topic: str) -> bytes:
+        try:
+            data = self._encoded[topic]
+        except KeyError:
+            self.misses += 1
+            data = _encode_utf8(topic)
+            self._store(self._encoded, topic, data)
+        else:
+            self.hits += 1
+            self._encoded.move_to_end(topic)
+        return data
+
+    def decode(self, data: bytes | memoryview) -> str:
+        key = bytes(data)
+        try:
+            topic = self._decoded[key]
+        except KeyError:
+            self.misses += 1
+            topic = sys.intern(str(key, 'utf-8'))
+            self._store(self._decoded, key, topic)
+        else:
+            self.hits += 1
+            self._decoded.move_to_end(key)
+        return topic
+
+    def clear(self):
+        self._encoded.clear()
+        self._decoded.clear()
+
+    def __len__(self) -> int:
+        return len(self._encoded) + len(self._decoded)
+
+    def _store(self, entries: OrderedDict, key, value):
+        entries[key] = value
+        if len(entries) > self.capacity:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+
+class BufferPool:
+    __slots__ = (
+        'budget', 'minimum', 'maximum', 'hits', 'misses', 'discards', 'inUse', 'highWater', 'pooled', '_free'
+    )
+
+    def __init__(self, budget: int = 16 * 1024 * 1024, minimum: int = 256, maximum: int = 1024 * 1024):
+        # bytes kept idle in the pool, larger releases are dropped
+        self.budget = budget
+
+        # size classes are powers of two, requests above maximum are not pooled
+        self.minimum = minimum
+        self.maximum = maximum
+
+        self.hits = 0
+        self.misses = 0
+        self.discards = 0
+        self.inUse = 0
+        self.highWater = 0
+        self.pooled = 0
+        self._free = {}
+
+    def acquire(self, size: int) -> bytearray:
+        capacity = self._size_class(size)
+        free = self._free.get(capacity)
+        if free:
+            self.hits += 1
+            self.pooled -= capacity
+            buffer = free.pop()
+        else:
+            self.misses += 1
+            buffer = bytearray(capacity if capacity <= self.maximum else size)
+
+        self.inUse += len(buffer)
+        if self.inUse > self.highWater:
+            self.highWater = self.inUse
+        return buffer
+
+    def release(self, buffer: bytearray | memoryview):
+        if isinstance(buffer, memoryview):
+            view = buffer
+            buffer = view.obj
+            view.release()
+
+        size = len(buffer)
+        self.inUse -= size
+        if size > self.maximum or size != self._size_class(size) or self.pooled + size > self.budget:
+            self.discards += 1
+            return
+        self._free.setdefault(size, []).append(buffer)
+        self.pooled += size
+
+    def borrow(self, size: int) -> '_BorrowedBuffer':
+        return _BorrowedBuffer(self, self.acquire(size))
+
+    def clear(self):
+        self._free.clear()
+        self.pooled = 0
+
+    def _size_class(self, size: int) -> int:
+        if size <= self.minimum:
+            return self.minimum
+        return 1 << (size - 1).bit_length()
+
+
+class _BorrowedBuffer:
+    __slots__ = ('pool', 'buffer')
+
+    def __init__(self, pool: BufferPool, buffer: bytearray):
+        self.pool = pool
+        self.buffer = buffer
+
+    def __enter__(self) -> bytearray:
+        return self.buffer
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.pool.release(self.buffer)
+
+
+class PacketPool:
+    __slots__ = ('capacity', 'hits', 'misses', 'discards', '_free')
+
+    def __init__(self, capacity: int = 1024):
+        # idle instances kept per packet type
+        self.capacity = capacity
+
+        self.hits = 0
+        self.misses = 0
+        self.discards = 0
+        self._free = {}
+
+    def acquire(self, packet_type: int) -> 'Packet':
+        free = self._free.get(packet_type)
+        if free:
+            self.hits += 1
+            return free.pop()
+        self.misses += 1
+        return _PACKET_CLASS[packet_type]()
+
+    def release(self, packet: 'Packet'):
+        # a released packet and the values read from it must no longer be used by the caller
+        if type(packet) is not _PACKET_CLASS[packet.type]:
+            self.discards += 1
+            return
+        free = self._free.setdefault(packet.type, [])
+        if len(free) >= self.capacity:
+            self.discards += 1
+            return
+        free.append(packet)
+
+    def clear(self):
+        self._free.clear()
+
+
 class Packet:
+    __slots__ = ('type', 'flag')
+
     def __init__(self, packet_type: int):
         # Fixed Header
         self.type = packet_type
@@ -75,6 +246,8 @@ class Packet:
 
 
 class UserProperties(tuple):
+    __slots__ = ()
+
     def __new__(cls, *user_property, **kw_user_property):
         property_tuple = ()
         for value in user_property:
@@ -85,6 +258,8 @@ class UserProperties(tuple):
 
 
 class QoSPacket(Packet):
+    __slots__ = ('packetIdentifier', 'reasonCode', 'reasonString', 'userProperties')
+
     def __init__(
             self, packet_type, packet_identifier: int = 0, reason_code: int = None, reason_string: str = None,
             user_properties: UserProperties = None
@@ -101,6 +276,8 @@ class QoSPacket(Packet):
 
 
 class Subscription:
+    __slots__ = ('topic', 'QoS', 'NL', 'RAP', 'retainHandling')
+
     def __init__(self, topic: str, qos: int = 0, nl: bool = False, rap: bool = False, retain_handling: int = 0):
         self.topic = topic
         self.QoS = qos
@@ -110,6 +287,11 @@ class Subscription:
 
 
 class Will:
+    __slots__ = (
+        'topic', 'payload', 'QoS', 'retain', 'willDelayInterval', 'payloadFormatIndicator', 'messageExpiryInterval',
+        'contentType', 'responseTopic', 'correlationData', 'userProperties'
+    )
+
     def __init__(
             self, topic: str = '', payload: bytes = b'', qos: int = 0, retain: bool = False,
             will_delay_interval: int = None, payload_format_indicator: bool = None, message_expiry_interval: int = None,
@@ -135,6 +317,12 @@ class Will:
 
 
 class CONNECT(Packet):
+    __slots__ = (
+        'clientID', 'username', 'password', 'will', 'cleanStart', 'keepAlive', 'sessionExpiryInterval',
+        'receiveMaximum', 'maximumPacketSize', 'topicAliasMaximum', 'requestResponseInformation',
+        'requestProblemInformation', 'userProperties', 'authenticationMethod', 'authenticationData'
+    )
+
     def __init__(
             self, client_id: str = '', username: str = None, password: bytes = None, will: Will = None,
             clean_start: bool = False, keep_alive: int = 0, session_expiry_interval: int = None,
@@ -169,6 +357,13 @@ class CONNECT(Packet):
 
 
 class CONNACK(Packet):
+    __slots__ = (
+        'sessionPresent', 'reasonCode', 'sessionExpiryInterval', 'receiveMaximum', 'maximumQoS', 'retainAvailable',
+        'maximumPacketSize', 'assignedClientIdentifier', 'topicAliasMaximum', 'reasonString', 'userProperties',
+        'wildcardSubscriptionAvailable', 'subscriptionIdentifiersAvailable', 'sharedSubscriptionAvailable',
+        'serverKeepAlive', 'responseInformation', 'serverReference', 'authenticationMethod', 'authenticationData'
+    )
+
     def __init__(
             self, reason_code: int = ReasonCode.SUCCESS, session_present: bool = False,
             session_expiry_interval: int = None, receive_maximum: int = None, maximum_qos: int = None,
@@ -208,6 +403,12 @@ class CONNACK(Packet):
 
 
 class PUBLISH(Packet):
+    __slots__ = (
+        'DUP', 'QoS', 'RETAIN', 'payload', 'topic', 'packetIdentifier', 'payloadFormatIndicator',
+        'messageExpiryInterval', 'topicAlias', 'responseTopic', 'correlationData', 'userProperties',
+        'subscriptionIdentifier', 'contentType'
+    )
+
     def __init__(
             self, topic: str = '', payload: bytes = None, packet_identifier: int = 0, dup: bool = False, qos: int = 0,
             retain: bool = False, payload_format_indicator: bool = None, message_expiry_interval: int = None,
@@ -239,7 +440,102 @@ class PUBLISH(Packet):
         self.contentType = content_type
 
 
+class LazyPUBLISH(PUBLISH):
+    __slots__ = ('_frame', '_copy', '_topicCache', '_propertiesOffset', '_properties', '_header')
+
+    _PROPERTY_NAMES = (
+        'payloadFormatIndicator', 'messageExpiryInterval', 'topicAlias', 'responseTopic', 'correlationData',
+        'userProperties', 'subscriptionIdentifier', 'contentType'
+    )
+
+    def __init__(self, frame: bytes | memoryview, copy: bool = True, topic_cache: TopicCache = None):
+        Packet.__init__(self, packet_type=Type.PUBLISH)
+        data = memoryview(frame)
+        length, byte = _decode_fixed_header(data)
+        if (data[0] >> 4) & 0b1111 != Type.PUBLISH or byte + length != len(data):
+            raise MalformedPacket
+
+        # Fixed Header
+        self.DUP = bool((data[0] >> 3) & 0b1)
+        self.QoS = (data[0] >> 1) & 0b11
+        self.RETAIN = bool(data[0] & 0b1)
+
+        # Variable Header
+        try:
+            self.topic, size = _decode_topic(data, byte, topic_cache)
+        except UnicodeDecodeError:
+            raise MalformedPacket
+        byte += size
+        self.packetIdentifier = 0
+        if self.QoS in (1, 2):
+            self.packetIdentifier, size = _decode_packet_identifier(data, byte)
+            byte += size
+
+        # Properties, decoded and validated on first access, a frame whose properties are never read is
+        # forwarded by encode() as it was received
+        self._frame = frame
+        self._copy = copy
+        self._topicCache = topic_cache
+        self._propertiesOffset = byte
+        self._properties = None
+        properties_length, size = _decode_vbi(data, byte)
+        byte += size + properties_length
+        if byte > len(data):
+            raise MalformedPacket
+
+        # Payload
+        self.payload = bytes(data[byte:]) if copy else data[byte:]
+
+        self._header = (self.DUP, self.QoS, self.RETAIN, self.topic, self.packetIdentifier, self.payload)
+
+    def __getattr__(self, name):
+        if name in LazyPUBLISH._PROPERTY_NAMES and self._properties is None:
+            self._unpack()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def _is_set(self, name: str) -> bool:
+        try:
+            object.__getattribute__(self, name)
+        except AttributeError:
+            return False
+        return True
+
+    def _unpack(self):
+        packet = PUBLISH()
+        try:
+            _decode_properties(
+                packet, _PROPERTY_CODEC[Type.PUBLISH], memoryview(self._frame), self._propertiesOffset, self._copy,
+                self._topicCache
+            )
+        except (IndexError, UnicodeDecodeError):
+            # the same error an eager decode reports
+            raise MalformedPacket
+        self._properties = tuple(getattr(packet, name) for name in LazyPUBLISH._PROPERTY_NAMES)
+
+        # keep values assigned before the properties were decoded
+        for name, value in zip(LazyPUBLISH._PROPERTY_NAMES, self._properties):
+            if not self._is_set(name):
+                setattr(self, name, value)
+
+    def _original(self) -> bytes | memoryview | None:
+        header = (self.DUP, self.QoS, self.RETAIN, self.topic, self.packetIdentifier)
+        if header != self._header[:-1] or self.payload is not self._header[-1]:
+            return None
+
+        if self._properties is None:
+            if not any(self._is_set(name) for name in LazyPUBLISH._PROPERTY_NAMES):
+                return self._frame
+            self._unpack()
+
+        if tuple(getattr(self, name) for name in LazyPUBLISH._PROPERTY_NAMES) != self._properties:
+            return None
+        return self._frame
+
+
 class PUBACK(QoSPacket):
+    __slots__ = ()
+
     def __init__(
             self, packet_identifier: int = 0, reason_code: int = None, reason_string: str = None,
             user_properties: UserProperties = None
@@ -251,6 +547,8 @@ class PUBACK(QoSPacket):
 
 
 class PUBREC(QoSPacket):
+    __slots__ = ()
+
     def __init__(
             self, packet_identifier: int = 0, reason_code: int = None, reason_string: str = None,
             user_properties: UserProperties = None
@@ -262,6 +560,8 @@ class PUBREC(QoSPacket):
 
 
 class PUBREL(QoSPacket):
+    __slots__ = ()
+
     def __init__(
             self, packet_identifier: int = 0, reason_code: int = None, reason_string: str = None,
             user_properties: UserProperties = None
@@ -273,6 +573,8 @@ class PUBREL(QoSPacket):
 
 
 class PUBCOMP(QoSPacket):
+    __slots__ = ()
+
     def __init__(
             self, packet_identifier: int = 0, reason_code: int = None, reason_string: str = None,
             user_properties: UserProperties = None
@@ -284,6 +586,8 @@ class PUBCOMP(QoSPacket):
 
 
 class SUBSCRIBE(Packet):
+    __slots__ = ('subscriptions', 'packetIdentifier', 'subscriptionIdentifier', 'userProperties')
+
     def __init__(
             self, *subscriptions, packet_identifier: int = 0, subscription_identifier: int = None,
             user_properties: UserProperties = None
@@ -302,6 +606,8 @@ class SUBSCRIBE(Packet):
 
 
 class SUBACK(Packet):
+    __slots__ = ('reasonCodes', 'packetIdentifier', 'reasonString', 'userProperties')
+
     def __init__(
             self, *reason_codes, packet_identifier: int = 0, reason_string: str = None,
             user_properties: UserProperties = None
@@ -320,6 +626,8 @@ class SUBACK(Packet):
 
 
 class UNSUBSCRIBE(Packet):
+    __slots__ = ('topics', 'packetIdentifier', 'userProperties')
+
     def __init__(
             self, *topics, packet_identifier: int = 0, user_properties: UserProperties = None
     ):
@@ -336,6 +644,8 @@ class UNSUBSCRIBE(Packet):
 
 
 class UNSUBACK(Packet):
+    __slots__ = ('reasonCodes', 'packetIdentifier', 'reasonString', 'userProperties')
+
     def __init__(
             self, *reason_codes, packet_identifier: int = 0, reason_string: str = None,
             user_properties: UserProperties = None
@@ -354,16 +664,22 @@ class UNSUBACK(Packet):
 
 
 class PINGREQ(Packet):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(packet_type=Type.PINGREQ)
 
 
 class PINGRESP(Packet):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(packet_type=Type.PINGRESP)
 
 
 class DISCONNECT(Packet):
+    __slots__ = ('reasonCode', 'sessionExpiryInterval', 'reasonString', 'userProperties', 'serverReference')
+
     def __init__(
             self, reason_code: int = None, session_expiry_interval: int = None, reason_string: str = None,
             user_properties: UserProperties = None, server_reference: str = None
@@ -381,6 +697,8 @@ class DISCONNECT(Packet):
 
 
 class AUTH(Packet):
+    __slots__ = ('reasonCode', 'authenticationMethod', 'authenticationData', 'reasonString', 'userProperties')
+
     def __init__(
             self, reason_code: int = None, authentication_method: str = None, authentication_data: bytes = None,
             reason_string: str = None, user_properties: UserProperties = None
@@ -397,10 +715,49 @@ class AUTH(Packet):
         self.userProperties = user_properties
 
 
+class Header:
+    __slots__ = ('type', 'flag', 'remainingLength', 'size', 'DUP', 'QoS', 'RETAIN', 'topic', 'packetIdentifier')
+
+    def __init__(self, packet_type: int, flag: int, remaining_length: int, size: int):
+        # Fixed Header
+        self.type = packet_type
+        self.flag = flag
+        self.remainingLength = remaining_length
+        self.size = size
+
+        # PUBLISH Flags
+        self.DUP = None
+        self.QoS = None
+        self.RETAIN = None
+
+        # PUBLISH Variable Header
+        self.topic = None
+        self.packetIdentifier = None
+
+
 class MalformedPacket(Exception):
     pass
 
 
+class ProtocolError(Exception):
+    def __init__(self, reason_code: int = ReasonCode.PROTOCOL_ERROR):
+        super().__init__(reason_code)
+        self.reasonCode = reason_code
+
+
+class PacketTooLarge(ProtocolError):
+    def __init__(self, reason_code: int = ReasonCode.PACKET_TOO_LARGE):
+        super().__init__(reason_code)
+
+
+class IncompletePacket(Exception):
+    pass
+
+
+class BufferTooSmall(Exception):
+    pass
+
+
 _FLAG = {
     Type.CONNECT: 0b0000,
     Type.CONNACK: 0b0000,
@@ -439,6 +796,17 @@ _PACKET_CLASS = {
 }
 
 
+_UINT = {
+    1: struct.Struct('>B'),
+    2: struct.Struct('>H'),
+    4: struct.Struct('>I')
+}
+
+_BYTE_PROPERTY = struct.Struct('>BB')
+_TWO_BYTE_PROPERTY = struct.Struct('>BH')
+_FOUR_BYTE_PROPERTY = struct.Struct('>BI')
+
+
 class _PropertyIdentifier:
     PAYLOAD_FORMAT_INDICATOR = 1
     MESSAGE_EXPIRY_INTERVAL = 2
@@ -492,222 +860,628 @@ _PROPERTY_NAME = {
     _PropertyIdentifier.TOPIC_ALIAS: 'topicAlias',
     _PropertyIdentifier.MAXIMUM_QOS: 'maximumQoS',
     _PropertyIdentifier.RETAIN_AVAILABLE: 'retainAvailable',
+    _PropertyIdentifier.USER_PROPERTY: 'userProperties',
     _PropertyIdentifier.MAXIMUM_PACKET_SIZE: 'maximumPacketSize',
     _PropertyIdentifier.WILDCARD_SUBSCRIPTION_AVAILABLE: 'wildcardSubscriptionAvailable',
     _PropertyIdentifier.SUBSCRIPTION_IDENTIFIER_AVAILABLE: 'subscriptionIdentifiersAvailable',
     _PropertyIdentifier.SHARED_SUBSCRIPTION_AVAILABLE: 'sharedSubscriptionAvailable',
 }
 
-_PROPERTY_ENCODING = {
-    _PropertyIdentifier.PAYLOAD_FORMAT_INDICATOR: lambda value: _encode_b(value),
-    _PropertyIdentifier.MESSAGE_EXPIRY_INTERVAL: lambda value: _encode_b(value, 4),
-    _PropertyIdentifier.CONTENT_TYPE: lambda value: _encode_utf8(value),
-    _PropertyIdentifier.RESPONSE_TOPIC: lambda value: _encode_utf8(value),
-    _PropertyIdentifier.CORRELATION_DATA: lambda value: _encode_bd(value),
-    _PropertyIdentifier.SUBSCRIPTION_IDENTIFIER: lambda value: _encode_vbi(value),
-    _PropertyIdentifier.SESSION_EXPIRY_INTERVAL: lambda value: _encode_b(value, 4),
-    _PropertyIdentifier.ASSIGNED_CLIENT_IDENTIFIER: lambda value: _encode_utf8(value),
-    _PropertyIdentifier.SERVER_KEEP_ALIVE: lambda value: _encode_b(value, 2),
-    _PropertyIdentifier.AUTHENTICATION_METHOD: lambda value: _encode_utf8(value),
-    _PropertyIdentifier.AUTHENTICATION_DATA: lambda value: _encode_bd(value),
-    _PropertyIdentifier.REQUEST_PROBLEM_INFORMATION: lambda value: _encode_b(value),
-    _PropertyIdentifier.WILL_DELAY_INTERVAL: lambda value: _encode_b(value, 4),
-    _PropertyIdentifier.REQUEST_RESPONSE_INFORMATION: lambda value: _encode_b(value),
-    _PropertyIdentifier.RESPONSE_INFORMATION: lambda value: _encode_utf8(value),
-    _PropertyIdentifier.SERVER_REFERENCE: lambda value: _encode_utf8(value),
-    _PropertyIdentifier.REASON_STRING: lambda value: _encode_utf8(value),
-    _PropertyIdentifier.RECEIVE_MAXIMUM: lambda value: _encode_b(value, 2),
-    _PropertyIdentifier.TOPIC_ALIAS_MAXIMUM: lambda value: _encode_b(value, 2),
-    _PropertyIdentifier.TOPIC_ALIAS: lambda value: _encode_b(value, 2),
-    _PropertyIdentifier.MAXIMUM_QOS: lambda value: _encode_b(value),
-    _PropertyIdentifier.RETAIN_AVAILABLE: lambda value: _encode_b(value),
-    _PropertyIdentifier.USER_PROPERTY: lambda value: _encode_utf8_pair(value[0], value[1]),
-    _PropertyIdentifier.MAXIMUM_PACKET_SIZE: lambda value: _encode_b(value, 4),
-    _PropertyIdentifier.WILDCARD_SUBSCRIPTION_AVAILABLE: lambda value: _encode_b(value),
-    _PropertyIdentifier.SUBSCRIPTION_IDENTIFIER_AVAILABLE: lambda value: _encode_b(value),
-    _PropertyIdentifier.SHARED_SUBSCRIPTION_AVAILABLE: lambda value: _encode_b(value)
+
+class _DataType:
+    BYTE = 1
+    BOOLEAN = 2
+    TWO_BYTE_INTEGER = 3
+    FOUR_BYTE_INTEGER = 4
+    VARIABLE_BYTE_INTEGER = 5
+    UTF8_STRING = 6
+    BINARY_DATA = 7
+    UTF8_STRING_PAIR = 8
+
+
+_PROPERTY_TYPE = {
+    _PropertyIdentifier.PAYLOAD_FORMAT_INDICATOR: _DataType.BOOLEAN,
+    _PropertyIdentifier.MESSAGE_EXPIRY_INTERVAL: _DataType.FOUR_BYTE_INTEGER,
+    _PropertyIdentifier.CONTENT_TYPE: _DataType.UTF8_STRING,
+    _PropertyIdentifier.RESPONSE_TOPIC: _DataType.UTF8_STRING,
+    _PropertyIdentifier.CORRELATION_DATA: _DataType.BINARY_DATA,
+    _PropertyIdentifier.SUBSCRIPTION_IDENTIFIER: _DataType.VARIABLE_BYTE_INTEGER,
+    _PropertyIdentifier.SESSION_EXPIRY_INTERVAL: _DataType.FOUR_BYTE_INTEGER,
+    _PropertyIdentifier.ASSIGNED_CLIENT_IDENTIFIER: _DataType.UTF8_STRING,
+    _PropertyIdentifier.SERVER_KEEP_ALIVE: _DataType.TWO_BYTE_INTEGER,
+    _PropertyIdentifier.AUTHENTICATION_METHOD: _DataType.UTF8_STRING,
+    _PropertyIdentifier.AUTHENTICATION_DATA: _DataType.BINARY_DATA,
+    _PropertyIdentifier.REQUEST_PROBLEM_INFORMATION: _DataType.BOOLEAN,
+    _PropertyIdentifier.WILL_DELAY_INTERVAL: _DataType.FOUR_BYTE_INTEGER,
+    _PropertyIdentifier.REQUEST_RESPONSE_INFORMATION: _DataType.BOOLEAN,
+    _PropertyIdentifier.RESPONSE_INFORMATION: _DataType.UTF8_STRING,
+    _PropertyIdentifier.SERVER_REFERENCE: _DataType.UTF8_STRING,
+    _PropertyIdentifier.REASON_STRING: _DataType.UTF8_STRING,
+    _PropertyIdentifier.RECEIVE_MAXIMUM: _DataType.TWO_BYTE_INTEGER,
+    _PropertyIdentifier.TOPIC_ALIAS_MAXIMUM: _DataType.TWO_BYTE_INTEGER,
+    _PropertyIdentifier.TOPIC_ALIAS: _DataType.TWO_BYTE_INTEGER,
+    _PropertyIdentifier.MAXIMUM_QOS: _DataType.BYTE,
+    _PropertyIdentifier.RETAIN_AVAILABLE: _DataType.BOOLEAN,
+    _PropertyIdentifier.USER_PROPERTY: _DataType.UTF8_STRING_PAIR,
+    _PropertyIdentifier.MAXIMUM_PACKET_SIZE: _DataType.FOUR_BYTE_INTEGER,
+    _PropertyIdentifier.WILDCARD_SUBSCRIPTION_AVAILABLE: _DataType.BOOLEAN,
+    _PropertyIdentifier.SUBSCRIPTION_IDENTIFIER_AVAILABLE: _DataType.BOOLEAN,
+    _PropertyIdentifier.SHARED_SUBSCRIPTION_AVAILABLE: _DataType.BOOLEAN
 }
 
-_PROPERTY_DECODING = {
-    _PropertyIdentifier.PAYLOAD_FORMAT_INDICATOR: lambda bytedata: (bool(_decode_b(bytedata)), 1),
-    _PropertyIdentifier.MESSAGE_EXPIRY_INTERVAL: lambda bytedata: (_decode_b(bytedata, 4), 4),
-    _PropertyIdentifier.CONTENT_TYPE: lambda bytedata: _decode_utf8(bytedata),
-    _PropertyIdentifier.RESPONSE_TOPIC: lambda bytedata: _decode_utf8(bytedata),
-    _PropertyIdentifier.CORRELATION_DATA: lambda bytedata: _decode_bd(bytedata),
-    _PropertyIdentifier.SUBSCRIPTION_IDENTIFIER: lambda bytedata: _decode_vbi(bytedata),
-    _PropertyIdentifier.SESSION_EXPIRY_INTERVAL: lambda bytedata: (_decode_b(bytedata, 4), 4),
-    _PropertyIdentifier.ASSIGNED_CLIENT_IDENTIFIER: lambda bytedata: _decode_utf8(bytedata),
-    _PropertyIdentifier.SERVER_KEEP_ALIVE: lambda bytedata: (_decode_b(bytedata, 2), 2),
-    _PropertyIdentifier.AUTHENTICATION_METHOD: lambda bytedata: _decode_utf8(bytedata),
-    _PropertyIdentifier.AUTHENTICATION_DATA: lambda bytedata: _decode_bd(bytedata),
-    _PropertyIdentifier.REQUEST_PROBLEM_INFORMATION: lambda bytedata: (bool(_decode_b(bytedata)), 1),
-    _PropertyIdentifier.WILL_DELAY_INTERVAL: lambda bytedata: (_decode_b(bytedata, 4), 4),
-    _PropertyIdentifier.REQUEST_RESPONSE_INFORMATION: lambda bytedata: (bool(_decode_b(bytedata)), 1),
-    _PropertyIdentifier.RESPONSE_INFORMATION: lambda bytedata: _decode_utf8(bytedata),
-    _PropertyIdentifier.SERVER_REFERENCE: lambda bytedata: _decode_utf8(bytedata),
-    _PropertyIdentifier.REASON_STRING: lambda bytedata: _decode_utf8(bytedata),
-    _PropertyIdentifier.RECEIVE_MAXIMUM: lambda bytedata: (_decode_b(bytedata, 2), 2),
-    _PropertyIdentifier.TOPIC_ALIAS_MAXIMUM: lambda bytedata: (_decode_b(bytedata, 2), 2),
-    _PropertyIdentifier.TOPIC_ALIAS: lambda bytedata: (_decode_b(bytedata, 2), 2),
-    _PropertyIdentifier.MAXIMUM_QOS: lambda bytedata: (_decode_b(bytedata), 1),
-    _PropertyIdentifier.RETAIN_AVAILABLE: lambda bytedata: (bool(_decode_b(bytedata)), 1),
-    _PropertyIdentifier.USER_PROPERTY: lambda bytedata: _decode_utf8_pair(bytedata),
-    _PropertyIdentifier.MAXIMUM_PACKET_SIZE: lambda bytedata: (_decode_b(bytedata, 4), 4),
-    _PropertyIdentifier.WILDCARD_SUBSCRIPTION_AVAILABLE: lambda bytedata: (bool(_decode_b(bytedata)), 1),
-    _PropertyIdentifier.SUBSCRIPTION_IDENTIFIER_AVAILABLE: lambda bytedata: (bool(_decode_b(bytedata)), 1),
-    _PropertyIdentifier.SHARED_SUBSCRIPTION_AVAILABLE: lambda bytedata: (bool(_decode_b(bytedata)), 1)
+
+# properties of every packet type, in encoding order
+_PROPERTY_SCHEMA = {
+    Type.CONNECT: (
+        _PropertyIdentifier.SESSION_EXPIRY_INTERVAL,
+        _PropertyIdentifier.RECEIVE_MAXIMUM,
+        _PropertyIdentifier.MAXIMUM_PACKET_SIZE,
+        _PropertyIdentifier.TOPIC_ALIAS_MAXIMUM,
+        _PropertyIdentifier.REQUEST_RESPONSE_INFORMATION,
+        _PropertyIdentifier.REQUEST_PROBLEM_INFORMATION,
+        _PropertyIdentifier.AUTHENTICATION_METHOD,
+        _PropertyIdentifier.AUTHENTICATION_DATA,
+        _PropertyIdentifier.USER_PROPERTY,
+    ),
+    Type.CONNACK: (
+        _PropertyIdentifier.SESSION_EXPIRY_INTERVAL,
+        _PropertyIdentifier.RECEIVE_MAXIMUM,
+        _PropertyIdentifier.MAXIMUM_QOS,
+        _PropertyIdentifier.RETAIN_AVAILABLE,
+        _PropertyIdentifier.MAXIMUM_PACKET_SIZE,
+        _PropertyIdentifier.ASSIGNED_CLIENT_IDENTIFIER,
+        _PropertyIdentifier.TOPIC_ALIAS_MAXIMUM,
+        _PropertyIdentifier.REASON_STRING,
+        _PropertyIdentifier.WILDCARD_SUBSCRIPTION_AVAILABLE,
+        _PropertyIdentifier.SUBSCRIPTION_IDENTIFIER_AVAILABLE,
+        _PropertyIdentifier.SHARED_SUBSCRIPTION_AVAILABLE,
+        _PropertyIdentifier.SERVER_KEEP_ALIVE,
+        _PropertyIdentifier.RESPONSE_INFORMATION,
+        _PropertyIdentifier.SERVER_REFERENCE,
+        _PropertyIdentifier.AUTHENTICATION_METHOD,
+        _PropertyIdentifier.AUTHENTICATION_DATA,
+        _PropertyIdentifier.USER_PROPERTY,
+    ),
+    Type.PUBLISH: (
+        _PropertyIdentifier.PAYLOAD_FORMAT_INDICATOR,
+        _PropertyIdentifier.MESSAGE_EXPIRY_INTERVAL,
+        _PropertyIdentifier.TOPIC_ALIAS,
+        _PropertyIdentifier.RESPONSE_TOPIC,
+        _PropertyIdentifier.CORRELATION_DATA,
+        _PropertyIdentifier.SUBSCRIPTION_IDENTIFIER,
+        _PropertyIdentifier.CONTENT_TYPE,
+        _PropertyIdentifier.USER_PROPERTY,
+    ),
+    Type.PUBACK: (_PropertyIdentifier.REASON_STRING, _PropertyIdentifier.USER_PROPERTY),
+    Type.PUBREC: (_PropertyIdentifier.REASON_STRING, _PropertyIdentifier.USER_PROPERTY),
+    Type.PUBREL: (_PropertyIdentifier.REASON_STRING, _PropertyIdentifier.USER_PROPERTY),
+    Type.PUBCOMP: (_PropertyIdentifier.REASON_STRING, _PropertyIdentifier.USER_PROPERTY),
+    Type.SUBSCRIBE: (_PropertyIdentifier.SUBSCRIPTION_IDENTIFIER, _PropertyIdentifier.USER_PROPERTY),
+    Type.SUBACK: (_PropertyIdentifier.REASON_STRING, _PropertyIdentifier.USER_PROPERTY),
+    Type.UNSUBSCRIBE: (_PropertyIdentifier.USER_PROPERTY,),
+    Type.UNSUBACK: (_PropertyIdentifier.REASON_STRING, _PropertyIdentifier.USER_PROPERTY),
+    Type.PINGREQ: (),
+    Type.PINGRESP: (),
+    Type.DISCONNECT: (
+        _PropertyIdentifier.SESSION_EXPIRY_INTERVAL,
+        _PropertyIdentifier.REASON_STRING,
+        _PropertyIdentifier.SERVER_REFERENCE,
+        _PropertyIdentifier.USER_PROPERTY,
+    ),
+    Type.AUTH: (
+        _PropertyIdentifier.AUTHENTICATION_METHOD,
+        _PropertyIdentifier.AUTHENTICATION_DATA,
+        _PropertyIdentifier.REASON_STRING,
+        _PropertyIdentifier.USER_PROPERTY,
+    ),
 }
 
+# properties that carry a topic name and go through the TopicCache
+_TOPIC_PROPERTIES = (_PropertyIdentifier.RESPONSE_TOPIC,)
+
+_WILL_PROPERTY_SCHEMA = (
+    _PropertyIdentifier.WILL_DELAY_INTERVAL,
+    _PropertyIdentifier.PAYLOAD_FORMAT_INDICATOR,
+    _PropertyIdentifier.MESSAGE_EXPIRY_INTERVAL,
+    _PropertyIdentifier.RESPONSE_TOPIC,
+    _PropertyIdentifier.CORRELATION_DATA,
+    _PropertyIdentifier.CONTENT_TYPE,
+    _PropertyIdentifier.USER_PROPERTY,
+)
+
+
+class _PropertyCodec:
+    __slots__ = ('size', 'write', 'read', 'reset')
+
+    def __init__(self, schema: tuple):
+        size = ['def size(packet):', '    length = 0']
+        reset = ['def reset(packet):', '    pass']
+        write = ['def write(packet, buffer, byte, cache=None):']
+        read = [
+            'def read(packet, data, byte, end, copy, cache=None):',
+            '    user_properties = []',
+            '    while byte < end:',
+            '        identifier = data[byte]',
+        ]
+
+        for index, identifier in enumerate(schema):
+            name = _PROPERTY_NAME[identifier]
+            reset.append(f'    if packet.{name} is not None:')
+            reset.append(f'        packet.{name} = None')
+            size.append(f'    value = packet.{name}')
+            size.append('    if value is not None:')
+            write.append(f'    value = packet.{name}')
+            write.append('    if value is not None:')
+            read.append(f'        {"if" if index == 0 else "elif"} identifier == {identifier}:')
+
+            match _PROPERTY_TYPE[identifier]:
+                case _DataType.BYTE | _DataType.BOOLEAN | _DataType.TWO_BYTE_INTEGER | _DataType.FOUR_BYTE_INTEGER:
+                    header, width = _PROPERTY_HEADER[_PROPERTY_TYPE[identifier]]
+                    size.append(f'        length += {1 + width}')
+                    write.append(f'        {header}.pack_into(buffer, byte, {identifier}, value)')
+                    write.append(f'        byte += {1 + width}')
+                    value = f'{header}.unpack_from(data, byte)[1]'
+                    if _PROPERTY_TYPE[identifier] == _DataType.BOOLEAN:
+                        value = f'bool({value})'
+                    read.append(f'            value = {value}')
+                    read.append(f'            byte += {1 + width}')
+                case _DataType.VARIABLE_BYTE_INTEGER:
+                    size.append('        length += 1 + _size_vbi(value)')
+                    write.append(f'        buffer[byte] = {identifier}')
+                    write.append('        byte = _write_vbi(buffer, byte + 1, value)')
+                    read.append('            value, size = _decode_vbi(data, byte + 1)')
+                    read.append('            byte += 1 + size')
+                case _DataType.UTF8_STRING if identifier in _TOPIC_PROPERTIES:
+                    size.append('        length += 1 + _size_utf8(value)')
+                    write.append(f'        buffer[byte] = {identifier}')
+                    write.append('        byte = _write_topic(buffer, byte + 1, value, cache)')
+                    read.append('            value, size = _decode_topic(data, byte + 1, cache)')
+                    read.append('            byte += 1 + size')
+                case _DataType.UTF8_STRING:
+                    size.append('        length += 1 + _size_utf8(value)')
+                    write.append(f'        buffer[byte] = {identifier}')
+                    write.append('        byte = _write_utf8(buffer, byte + 1, value)')
+                    read.append('            value, size = _decode_utf8(data, byte + 1)')
+                    read.append('            byte += 1 + size')
+                case _DataType.BINARY_DATA:
+                    size.append('        length += 1 + _size_bd(value)')
+                    write.append(f'        buffer[byte] = {identifier}')
+                    write.append('        byte = _write_bd(buffer, byte + 1, value)')
+                    read.append('            value, size = _decode_bd(data, byte + 1, copy)')
+                    read.append('            byte += 1 + size')
+                case _DataType.UTF8_STRING_PAIR:
+                    size.append('        for key, item in value:')
+                    size.append('            length += 1 + _size_utf8(key) + _size_utf8(item)')
+                    write.append('        for key, item in value:')
+                    write.append(f'            buffer[byte] = {identifier}')
+                    write.append('            byte = _write_utf8_pair(buffer, byte + 1, key, item)')
+                    read.append('            value, size = _decode_utf8_pair(data, byte + 1)')
+                    read.append('            byte += 1 + size')
+                    read.append('            user_properties.append(value)')
+                    continue
+
+            # the first occurrence of a property is kept
+            read.append(f'            if packet.{name} is None:')
+            read.append(f'                packet.{name} = value')
+
+        size.append('    return length')
+        write.append('    return byte')
+        if schema:
+            read.append('        else:')
+            read.append('            raise MalformedPacket')
+        else:
+            read.append('        raise MalformedPacket')
+        read.append('    if byte != end:')
+        read.append('        raise MalformedPacket')
+        if _PropertyIdentifier.USER_PROPERTY in schema:
+            read.append('    packet.userProperties = tuple.__new__(UserProperties, user_properties)')
+        read.append('    return byte')
+
+        namespace = {}
+        exec('\n'.join(size + [''] + write + [''] + read + [''] + reset), globals(), namespace)
+        self.size = namespace['size']
+        self.write = namespace['write']
+        self.read = namespace['read']
+        self.reset = namespace['reset']
+
+
+_PROPERTY_HEADER = {
+    _DataType.BYTE: ('_BYTE_PROPERTY', 1),
+    _DataType.BOOLEAN: ('_BYTE_PROPERTY', 1),
+    _DataType.TWO_BYTE_INTEGER: ('_TWO_BYTE_PROPERTY', 2),
+    _DataType.FOUR_BYTE_INTEGER: ('_FOUR_BYTE_PROPERTY', 4)
+}
 
-class _Property:
-    def __init__(self, identifier: int, value):
-        self.identifier = identifier
-        self.value = value
+_PROPERTY_CODEC = {packet_type: _PropertyCodec(schema) for packet_type, schema in _PROPERTY_SCHEMA.items()}
 
+_WILL_PROPERTY_CODEC = _PropertyCodec(_WILL_PROPERTY_SCHEMA)
 
-def _pack_properties(packet) -> tuple:
-    properties = ()
-    match packet.type:
-        case Type.CONNECT:
-            properties = (
-                _Property(_PropertyIdentifier.SESSION_EXPIRY_INTERVAL, packet.sessionExpiryInterval),
-                _Property(_PropertyIdentifier.RECEIVE_MAXIMUM, packet.receiveMaximum),
-                _Property(_PropertyIdentifier.MAXIMUM_PACKET_SIZE, packet.maximumPacketSize),
-                _Property(_PropertyIdentifier.TOPIC_ALIAS_MAXIMUM, packet.topicAliasMaximum),
-                _Property(_PropertyIdentifier.REQUEST_RESPONSE_INFORMATION, packet.requestResponseInformation),
-                _Property(_PropertyIdentifier.REQUEST_PROBLEM_INFORMATION, packet.requestProblemInformation),
-                _Property(_PropertyIdentifier.AUTHENTICATION_METHOD, packet.authenticationMethod),
-                _Property(_PropertyIdentifier.AUTHENTICATION_DATA, packet.authenticationData),
-            )
-        case Type.CONNACK:
-            properties = (
-                _Property(_PropertyIdentifier.SESSION_EXPIRY_INTERVAL, packet.sessionExpiryInterval),
-                _Property(_PropertyIdentifier.RECEIVE_MAXIMUM, packet.receiveMaximum),
-                _Property(_PropertyIdentifier.MAXIMUM_QOS, packet.maximumQoS),
-                _Property(_PropertyIdentifier.RETAIN_AVAILABLE, packet.retainAvailable),
-                _Property(_PropertyIdentifier.MAXIMUM_PACKET_SIZE, packet.maximumPacketSize),
-                _Property(_PropertyIdentifier.ASSIGNED_CLIENT_IDENTIFIER, packet.assignedClientIdentifier),
-                _Property(_PropertyIdentifier.TOPIC_ALIAS_MAXIMUM, packet.topicAliasMaximum),
-                _Property(_PropertyIdentifier.REASON_STRING, packet.reasonString),
-                _Property(_PropertyIdentifier.WILDCARD_SUBSCRIPTION_AVAILABLE, packet.wildcardSubscriptionAvailable),
-                _Property(
-                    _PropertyIdentifier.SUBSCRIPTION_IDENTIFIER_AVAILABLE, packet.subscriptionIdentifiersAvailable
-                ),
-                _Property(_PropertyIdentifier.SHARED_SUBSCRIPTION_AVAILABLE, packet.sharedSubscriptionAvailable),
-                _Property(_PropertyIdentifier.SERVER_KEEP_ALIVE, packet.serverKeepAlive),
-                _Property(_PropertyIdentifier.RESPONSE_INFORMATION, packet.responseInformation),
-                _Property(_PropertyIdentifier.SERVER_REFERENCE, packet.serverReference),
-                _Property(_PropertyIdentifier.AUTHENTICATION_METHOD, packet.authenticationMethod),
-                _Property(_PropertyIdentifier.AUTHENTICATION_DATA, packet.authenticationData),
-            )
-        case Type.PUBLISH:
-            properties = (
-                _Property(_PropertyIdentifier.PAYLOAD_FORMAT_INDICATOR, packet.payloadFormatIndicator),
-                _Property(_PropertyIdentifier.MESSAGE_EXPIRY_INTERVAL, packet.messageExpiryInterval),
-                _Property(_PropertyIdentifier.TOPIC_ALIAS, packet.topicAlias),
-                _Property(_PropertyIdentifier.RESPONSE_TOPIC, packet.responseTopic),
-                _Property(_PropertyIdentifier.CORRELATION_DATA, packet.correlationData),
-                _Property(_PropertyIdentifier.SUBSCRIPTION_IDENTIFIER, packet.subscriptionIdentifier),
-                _Property(_PropertyIdentifier.CONTENT_TYPE, packet.contentType),
-            )
-        case Type.PUBACK | Type.PUBREC | Type.PUBREL | Type.PUBCOMP:
-            properties = (
-                _Property(_PropertyIdentifier.REASON_STRING, packet.reasonString),
-            )
-        case Type.SUBSCRIBE:
-            properties = (
-                _Property(_PropertyIdentifier.SUBSCRIPTION_IDENTIFIER, packet.subscriptionIdentifier),
-            )
-        case Type.SUBACK:
-            properties = (
-                _Property(_PropertyIdentifier.REASON_STRING, packet.reasonString),
-            )
-        case Type.UNSUBACK:
-            properties = (
-                _Property(_PropertyIdentifier.REASON_STRING, packet.reasonString),
-            )
-        case Type.DISCONNECT:
-            properties = (
-                _Property(_PropertyIdentifier.SESSION_EXPIRY_INTERVAL, packet.sessionExpiryInterval),
-                _Property(_PropertyIdentifier.REASON_STRING, packet.reasonString),
-                _Property(_PropertyIdentifier.SERVER_REFERENCE, packet.serverReference),
-            )
-        case Type.AUTH:
-            properties = (
-                _Property(_PropertyIdentifier.AUTHENTICATION_METHOD, packet.authenticationMethod),
-                _Property(_PropertyIdentifier.AUTHENTICATION_DATA, packet.authenticationData),
-                _Property(_PropertyIdentifier.REASON_STRING, packet.reasonString),
-            )
+# PublishTemplate writes the subscription identifier per subscriber
+_TEMPLATE_PROPERTY_CODEC = _PropertyCodec(
+    tuple(
+        identifier for identifier in _PROPERTY_SCHEMA[Type.PUBLISH]
+        if identifier != _PropertyIdentifier.SUBSCRIPTION_IDENTIFIER
+    )
+)
+
+# Reason String and User Properties may be left out of packets that would exceed the Maximum Packet Size
+_TRIMMED_PROPERTY_CODEC = {
+    packet_type: (
+        _PropertyCodec(tuple(
+            identifier for identifier in schema if identifier != _PropertyIdentifier.REASON_STRING
+        )),
+        _PropertyCodec(tuple(
+            identifier for identifier in schema
+            if identifier not in (_PropertyIdentifier.REASON_STRING, _PropertyIdentifier.USER_PROPERTY)
+        ))
+    )
+    for packet_type, schema in _PROPERTY_SCHEMA.items() if _PropertyIdentifier.REASON_STRING in schema
+}
 
-    properties = tuple(item for item in properties if item.value is not None)
-    if hasattr(packet, 'userProperties') and packet.userProperties is not None:
-        properties += _pack_user_properties(packet.userProperties)
-    return properties
 
+def encoded_size(packet) -> int:
+    frame = _original_frame(packet)
+    if frame is not None:
+        return len(frame)
+    return _frame_size(_layout(packet)[-1])
+
+
+def encode(
+        packet, topic_cache: TopicCache = None, maximum_packet_size: int = None, trim: bool = False,
+        pool: BufferPool = None
+) -> bytes | bytearray | memoryview:
+    frame = _original_frame(packet)
+    if frame is not None:
+        if maximum_packet_size is not None and len(frame) > maximum_packet_size:
+            raise PacketTooLarge
+        if pool is None:
+            return bytes(frame)
+        buffer = pool.acquire(len(frame))
+        buffer[:len(frame)] = frame
+        return memoryview(buffer)[:len(frame)]
+
+    layout = _fitted_layout(packet, maximum_packet_size, trim)
+    size = _frame_size(layout[-1])
+
+    # a pooled frame is a view on the pool's buffer, given back with pool.release()
+    if pool is not None:
+        buffer = pool.acquire(size)
+        _write_packet(packet, buffer, 0, layout, topic_cache=topic_cache)
+        return memoryview(buffer)[:size]
+
+    # a PUBLISH payload is appended to the header, so it is copied once and never zero-filled first
+    if packet.type == Type.PUBLISH and packet.payload:
+        buffer = bytearray(size - len(packet.payload))
+        _write_packet(packet, buffer, 0, layout, False, topic_cache)
+        buffer += packet.payload
+        return buffer
+
+    buffer = bytearray(size)
+    _write_packet(packet, buffer, 0, layout, topic_cache=topic_cache)
+    return buffer
+
+
+def encode_into(
+        packet, buffer: bytearray | memoryview, offset: int = 0, topic_cache: TopicCache = None,
+        maximum_packet_size: int = None, trim: bool = False
+) -> int:
+    frame = _original_frame(packet)
+    if frame is not None:
+        if maximum_packet_size is not None and len(frame) > maximum_packet_size:
+            raise PacketTooLarge
+        if offset < 0 or len(buffer) - offset < len(frame):
+            raise BufferTooSmall
+        buffer[offset:offset + len(frame)] = frame
+        return len(frame)
+
+    layout = _fitted_layout(packet, maximum_packet_size, trim)
+    size = _frame_size(layout[-1])
+    if offset < 0 or len(buffer) - offset < size:
+        raise BufferTooSmall
+    return _write_packet(packet, buffer, offset, layout, topic_cache=topic_cache) - offset
+
+
+class PublishTemplate:
+    def __init__(self, packet: PUBLISH):
+        self.packet = packet
+
+        # invariant Variable Header and Properties
+        self._topic = bytearray(_size_utf8(packet.topic))
+        _write_utf8(self._topic, 0, packet.topic)
+        self._properties = bytearray(_TEMPLATE_PROPERTY_CODEC.size(packet))
+        _TEMPLATE_PROPERTY_CODEC.write(packet, self._properties, 0)
+
+        # Payload
+        self.payload = packet.payload if packet.payload is not None else b''
+
+    def size(self, qos: int = None, subscription_identifiers: tuple = ()) -> int:
+        return _frame_size(self._remaining_length(qos, subscription_identifiers)[0])
+
+    def encode(
+            self, packet_identifier: int = 0, qos: int = None, dup: bool = False, retain: bool = None,
+            subscription_identifiers: tuple = ()
+    ) -> bytearray:
+        buffer = self.encode_header(packet_identifier, qos, dup, retain, subscription_identifiers)
+        buffer += self.payload
+        return buffer
+
+    def encode_header(
+            self, packet_identifier: int = 0, qos: int = None, dup: bool = False, retain: bool = None,
+            subscription_identifiers: tuple = ()
+    ) -> bytearray:
+        buffer = bytearray(self.size(qos, subscription_identifiers) - len(self.payload))
+        self._write_header(buffer, 0, packet_identifier, qos, dup, retain, subscription_identifiers)
+        return buffer
+
+    def encode_into(
+            self, buffer: bytearray | memoryview, offset: int = 0, packet_identifier: int = 0, qos: int = None,
+            dup: bool = False, retain: bool = None, subscription_identifiers: tuple = ()
+    ) -> int:
+        if offset < 0 or len(buffer) - offset < self.size(qos, subscription_identifiers):
+            raise BufferTooSmall
+        byte = self._write_header(buffer, offset, packet_identifier, qos, dup, retain, subscription_identifiers)
+        buffer[byte:byte + len(self.payload)] = self.payload
+        return byte + len(self.payload) - offset
+
+    def _remaining_length(self, qos: int = None, subscription_identifiers: tuple = ()) -> (int, int):
+        if qos is None:
+            qos = self.packet.QoS
+        properties_length = len(self._properties)
+        # one Subscription Identifier property for each matching subscription
+        for identifier in subscription_identifiers:
+            properties_length += 1 + _size_vbi(identifier)
+        length = len(self._topic) + _size_vbi(properties_length) + properties_length + len(self.payload)
+        if qos in (1, 2):
+            length += 2
+        return length, properties_length
+
+    def _write_header(
+            self, buffer: bytearray | memoryview, offset: int, packet_identifier: int, qos: int, dup: bool,
+            retain: bool, subscription_identifiers: tuple
+    ) -> int:
+        if qos is None:
+            qos = self.packet.QoS
+        if retain is None:
+            retain = self.packet.RETAIN
+        length, properties_length = self._remaining_length(qos, subscription_identifiers)
+
+        # Fixed Header
+        flag = _FLAG[Type.PUBLISH](dup=int(dup), qos=qos & 0b11, retain=int(retain))
+        byte = _write_b(buffer, offset, (Type.PUBLISH << 4) + flag)
+        byte = _write_vbi(buffer, byte, length)
 
-def _pack_will_properties(will: Will) -> tuple:
-    properties = (
-        _Property(_PropertyIdentifier.WILL_DELAY_INTERVAL, will.willDelayInterval),
-        _Property(_PropertyIdentifier.PAYLOAD_FORMAT_INDICATOR, will.payloadFormatIndicator),
-        _Property(_PropertyIdentifier.MESSAGE_EXPIRY_INTERVAL, will.messageExpiryInterval),
-        _Property(_PropertyIdentifier.RESPONSE_TOPIC, will.responseTopic),
-        _Property(_PropertyIdentifier.CORRELATION_DATA, will.correlationData),
-        _Property(_PropertyIdentifier.CONTENT_TYPE, will.contentType),
+        # Variable Header
+        buffer[byte:byte + len(self._topic)] = self._topic
+        byte += len(self._topic)
+        if qos in (1, 2):
+            byte = _write_packet_identifier(buffer, byte, packet_identifier)
+
+        # Properties
+        byte = _write_vbi(buffer, byte, properties_length)
+        for identifier in subscription_identifiers:
+            byte = _write_vbi(buffer, byte, _PropertyIdentifier.SUBSCRIPTION_IDENTIFIER)
+            byte = _write_vbi(buffer, byte, identifier)
+        buffer[byte:byte + len(self._properties)] = self._properties
+        return byte + len(self._properties)
+
+
+def encode_many(
+        packets, coalesce: bool = False, threshold: int = 4096, topic_cache: TopicCache = None,
+        maximum_packet_size: int = None
+) -> list:
+    plans = []
+    for packet in packets:
+        frame = _original_frame(packet)
+        layout = _layout(packet) if frame is None else None
+        size = len(frame) if frame is not None else _frame_size(layout[-1])
+        if maximum_packet_size is not None and size > maximum_packet_size:
+            raise PacketTooLarge
+
+        # large payloads are passed through as the caller's objects
+        payload = None
+        if (
+            not coalesce and packet.type == Type.PUBLISH and packet.payload is not None and
+            len(packet.payload) >= threshold
+        ):
+            payload = packet.payload
+        plans.append((packet, frame, layout, size, payload))
+
+    segments = []
+    start = 0
+    while start < len(plans):
+        # a block ends with the next packet whose payload is passed through
+        end = start
+        size = 0
+        while end < len(plans):
+            _, _, _, frame_size, payload = plans[end]
+            end += 1
+            if payload is not None:
+                size += frame_size - len(payload)
+                break
+            size += frame_size
+
+        buffer = bytearray(size)
+        byte = 0
+        for packet, frame, layout, frame_size, payload in plans[start:end]:
+            if frame is not None:
+                header_size = frame_size - (len(payload) if payload is not None else 0)
+                buffer[byte:byte + header_size] = frame[:header_size]
+                byte += header_size
+            else:
+                byte = _write_packet(packet, buffer, byte, layout, payload is None, topic_cache)
+
+        segments.append(buffer)
+        if plans[end - 1][4] is not None:
+            segments.append(plans[end - 1][4])
+        start = end
+
+    return segments
+
+
+def split_subscribe(
+        subscriptions, maximum_packet_size: int = None, subscription_identifier: int = None,
+        user_properties: UserProperties = None
+) -> list:
+    return _split(
+        subscriptions, maximum_packet_size, lambda subscription: _size_utf8(subscription.topic) + 1,
+        lambda chunk: SUBSCRIBE(
+            *chunk, subscription_identifier=subscription_identifier, user_properties=user_properties
+        )
     )
 
-    properties = tuple(item for item in properties if item.value is not None)
-    if will.userProperties is not None:
-        properties += _pack_user_properties(will.userProperties)
-    return properties
 
+def split_unsubscribe(topics, maximum_packet_size: int = None, user_properties: UserProperties = None) -> list:
+    return _split(
+        topics, maximum_packet_size, _size_utf8, lambda chunk: UNSUBSCRIBE(*chunk, user_properties=user_properties)
+    )
+
+
+def _split(items, maximum_packet_size: int, item_size, build) -> list:
+    maximum = MAXIMUM_PACKET_SIZE if maximum_packet_size is None else min(maximum_packet_size, MAXIMUM_PACKET_SIZE)
+
+    # every packet repeats the same Variable Header, only the Payload is split
+    base = _layout(build(()))[-1]
+
+    # filling each packet in order before starting the next gives the fewest packets
+    packets = []
+    chunk = []
+    length = base
+    for item in items:
+        size = item_size(item)
+        if _frame_size(base + size) > maximum:
+            raise PacketTooLarge
+        if chunk and _frame_size(length + size) > maximum:
+            packets.append(build(chunk))
+            chunk = []
+            length = base
+        chunk.append(item)
+        length += size
+    if chunk:
+        packets.append(build(chunk))
+    return packets
+
+
+def _original_frame(packet) -> bytes | memoryview | None:
+    if isinstance(packet, LazyPUBLISH):
+        return packet._original()
+    return None
+
+
+def _frame_size(length: int) -> int:
+    return 1 + _size_vbi(length) + length
 
-def _pack_user_properties(user_properties: UserProperties) -> tuple:
-    return tuple(
-        _Property(_PropertyIdentifier.USER_PROPERTY, user_property) for user_property in user_properties
+
+def _has_properties(packet, properties_length: int) -> bool:
+    if packet.type in (Type.PINGREQ, Type.PINGRESP):
+        return False
+
+    # packets with properties not required
+    return (
+        packet.type not in (Type.PUBACK, Type.PUBREC, Type.PUBREL, Type.PUBCOMP, Type.DISCONNECT, Type.AUTH) or
+        properties_length > 0
     )
 
 
-def _unpack_properties(obj, properties: tuple) -> bool:
-    try:
-        for value in properties:
-            if value.identifier != _PropertyIdentifier.USER_PROPERTY:
-                if hasattr(obj, _PROPERTY_NAME[value.identifier]):
-                    if getattr(obj, _PROPERTY_NAME[value.identifier]) is None:
-                        setattr(obj, _PROPERTY_NAME[value.identifier], value.value)
-                    else:
-                        return False
-
-        if hasattr(obj, 'userProperties'):
-            obj.userProperties = _unpack_user_properties(properties)
-        return True
-    except KeyError:
-        raise MalformedPacket
+def _fitted_layout(packet, maximum_packet_size: int = None, trim: bool = False) -> tuple:
+    layout = _layout(packet)
+    if maximum_packet_size is None or _frame_size(layout[-1]) <= maximum_packet_size:
+        return layout
+
+    # leave out the Reason String first, then the User Properties
+    if trim:
+        for codec in _TRIMMED_PROPERTY_CODEC.get(packet.type, ()):
+            layout = _layout(packet, codec)
+            if _frame_size(layout[-1]) <= maximum_packet_size:
+                return layout
+    raise PacketTooLarge
+
+
+def _layout(packet, codec: _PropertyCodec = None) -> (_PropertyCodec, int, int, int):
+    if codec is None:
+        codec = _PROPERTY_CODEC[packet.type]
+    properties_length = codec.size(packet)
+    will_properties_length = 0
+    length = 0
+
+    # Variable Header
+    match packet.type:
+        case Type.CONNECT:
+            length += _size_utf8(PROTOCOL_NAME) + 4
+
+        case Type.CONNACK:
+            length += 2
+
+        case Type.PUBLISH:
+            length += _size_utf8(packet.topic)
+            if packet.QoS in (1, 2):
+                length += 2
 
+        case (
+            Type.PUBACK | Type.PUBREC | Type.PUBREL | Type.PUBCOMP |
+            Type.SUBSCRIBE | Type.SUBACK | Type.UNSUBSCRIBE | Type.UNSUBACK
+        ):
+            length += 2
 
-def _unpack_user_properties(properties: tuple) -> UserProperties:
-    user_properties = ()
-    for value in properties:
-        if value.identifier == _PropertyIdentifier.USER_PROPERTY:
-            user_properties += (value.value,)
+    # packets with reason code not required
+    if packet.type in (Type.PUBACK, Type.PUBREC, Type.PUBREL, Type.PUBCOMP, Type.DISCONNECT, Type.AUTH):
+        if packet.reasonCode is not None or properties_length > 0:
+            length += 1
 
-    return UserProperties(*user_properties)
+    # Properties
+    if _has_properties(packet, properties_length):
+        length += _size_vbi(properties_length) + properties_length
 
+    # Payload
+    match packet.type:
+        case Type.CONNECT:
+            length += _size_utf8(packet.clientID)
+            if packet.will is not None:
+                will_properties_length = _WILL_PROPERTY_CODEC.size(packet.will)
+                length += _size_vbi(will_properties_length) + will_properties_length
+                length += _size_utf8(packet.will.topic)
+                length += _size_bd(packet.will.payload)
+            if packet.username is not None:
+                length += _size_utf8(packet.username)
+            if packet.password is not None:
+                length += _size_bd(packet.password)
 
-def encode(packet) -> bytes:
-    bytedata = bytes()
-    properties = _pack_properties(packet)
+        case Type.PUBLISH:
+            if packet.payload is not None:
+                length += len(packet.payload)
+
+        case Type.SUBSCRIBE:
+            for subscription in packet.subscriptions:
+                length += _size_utf8(subscription.topic) + 1
+
+        case Type.SUBACK | Type.UNSUBACK:
+            length += len(packet.reasonCodes)
+
+        case Type.UNSUBSCRIBE:
+            for topic in packet.topics:
+                length += _size_utf8(topic)
+
+    return codec, properties_length, will_properties_length, length
+
+
+def _write_packet(
+        packet, buffer: bytearray | memoryview, offset: int, layout: tuple, payload: bool = True,
+        topic_cache: TopicCache = None
+) -> int:
+    codec, properties_length, will_properties_length, length = layout
+    byte = offset
 
     # Fixed Header
     flag = packet.flag
     if callable(packet.flag) and packet.type == Type.PUBLISH:
         flag = flag(dup=packet.DUP, qos=packet.QoS, retain=packet.RETAIN)
-    fixed_header = _encode_b(((packet.type & 0b1111) << 4) + (flag & 0b1111))
+    byte = _write_b(buffer, byte, ((packet.type & 0b1111) << 4) + (flag & 0b1111))
+    byte = _write_vbi(buffer, byte, length)
 
     # Variable Header
     match packet.type:
         case Type.CONNECT:
-            bytedata += _encode_utf8(PROTOCOL_NAME)
-            bytedata += _encode_b(PROTOCOL_VERSION)
+            byte = _write_utf8(buffer, byte, PROTOCOL_NAME)
+            byte = _write_b(buffer, byte, PROTOCOL_VERSION)
             flags = (
                     (int(packet.username is not None) << 7) +
                     (int(packet.password is not None) << 6) +
@@ -717,100 +1491,152 @@ def encode(packet) -> bytes:
                 flags += 1 << 2
                 flags += int(packet.will.retain) << 5
                 flags += (packet.will.QoS & 0b11) << 3
-            bytedata += _encode_b(flags)
-            bytedata += _encode_b(packet.keepAlive, 2)
+            byte = _write_b(buffer, byte, flags)
+            byte = _write_b(buffer, byte, packet.keepAlive, 2)
 
         case Type.CONNACK:
-            flags = int(packet.sessionPresent)
-            bytedata += _encode_b(flags)
-            bytedata += _encode_b(packet.reasonCode)
+            byte = _write_b(buffer, byte, int(packet.sessionPresent))
+            byte = _write_b(buffer, byte, packet.reasonCode)
 
         case Type.PUBLISH:
-            bytedata += _encode_utf8(packet.topic)
+            byte = _write_topic(buffer, byte, packet.topic, topic_cache)
             if packet.QoS in (1, 2):
-                bytedata += _encode_packet_identifier(packet.packetIdentifier)
+                byte = _write_packet_identifier(buffer, byte, packet.packetIdentifier)
 
         case (
             Type.PUBACK | Type.PUBREC | Type.PUBREL | Type.PUBCOMP |
             Type.SUBSCRIBE | Type.SUBACK | Type.UNSUBSCRIBE | Type.UNSUBACK
         ):
-            bytedata += _encode_packet_identifier(packet.packetIdentifier)
+            byte = _write_packet_identifier(buffer, byte, packet.packetIdentifier)
 
     # packets with reason code not required
     if packet.type in (Type.PUBACK, Type.PUBREC, Type.PUBREL, Type.PUBCOMP, Type.DISCONNECT, Type.AUTH):
         if packet.reasonCode is None:
-            if len(properties) > 0:
-                bytedata += _encode_b(ReasonCode.SUCCESS)
+            if properties_length > 0:
+                byte = _write_b(buffer, byte, ReasonCode.SUCCESS)
         else:
-            bytedata += _encode_b(packet.reasonCode)
+            byte = _write_b(buffer, byte, packet.reasonCode)
 
     # Properties
-    if packet.type not in (Type.PINGREQ, Type.PINGRESP):
-
-        # packets with properties not required
-        if (
-            packet.type not in (Type.PUBACK, Type.PUBREC, Type.PUBREL, Type.PUBCOMP, Type.DISCONNECT, Type.AUTH) or
-            len(properties) > 0
-        ):
-            bytedata += _encode_properties(properties)
+    if _has_properties(packet, properties_length):
+        byte = _write_properties(buffer, byte, codec, packet, properties_length, topic_cache)
 
     # Payload
     match packet.type:
         case Type.CONNECT:
-            bytedata += _encode_utf8(packet.clientID)
+            byte = _write_utf8(buffer, byte, packet.clientID)
             if packet.will is not None:
-                bytedata += _encode_properties(_pack_will_properties(packet.will))
-                bytedata += _encode_utf8(packet.will.topic)
-                bytedata += _encode_bd(packet.will.payload)
+                byte = _write_properties(
+                    buffer, byte, _WILL_PROPERTY_CODEC, packet.will, will_properties_length, topic_cache
+                )
+                byte = _write_topic(buffer, byte, packet.will.topic, topic_cache)
+                byte = _write_bd(buffer, byte, packet.will.payload)
             if packet.username is not None:
-                bytedata += _encode_utf8(packet.username)
+                byte = _write_utf8(buffer, byte, packet.username)
             if packet.password is not None:
-                bytedata += _encode_bd(packet.password)
+                byte = _write_bd(buffer, byte, packet.password)
 
         case Type.PUBLISH:
-            if packet.payload is not None:
-                bytedata += packet.payload
+            if packet.payload is not None and payload:
+                buffer[byte:byte + len(packet.payload)] = packet.payload
+                byte += len(packet.payload)
 
         case Type.SUBSCRIBE:
-            bytedata += _encode_subscriptions(packet.subscriptions)
+            byte = _write_subscriptions(buffer, byte, packet.subscriptions, topic_cache)
 
         case Type.SUBACK | Type.UNSUBACK:
             for reasonCode in packet.reasonCodes:
-                bytedata += _encode_b(reasonCode)
+                byte = _write_b(buffer, byte, reasonCode)
 
         case Type.UNSUBSCRIBE:
             for topic in packet.topics:
-                bytedata += _encode_utf8(topic)
+                byte = _write_topic(buffer, byte, topic, topic_cache)
+
+    return byte
+
+
+def decode(
+        bytedata: bytes | bytearray | memoryview, offset: int = 0, copy: bool = True, lazy: bool = False,
+        topic_cache: TopicCache = None, into: Packet | PacketPool = None
+):
+    data = memoryview(bytedata)
+    length, fixed_header_length = _decode_fixed_header(data, offset)
+    packet = _decode_frame(data, offset, length, fixed_header_length, copy, lazy, topic_cache, into)
+    return packet, fixed_header_length + length
+
+
+def decode_all(
+        bytedata: bytes | bytearray | memoryview, offset: int = 0, copy: bool = True, lazy: bool = False,
+        group: bool = False, topic_cache: TopicCache = None, packet_pool: PacketPool = None
+) -> (list | dict, int):
+    data = memoryview(bytedata)
+    packets = {} if group else []
+    byte = offset
+    while byte < len(data):
+        try:
+            length, fixed_header_length = _decode_fixed_header(data, byte)
+        except IncompletePacket:
+            break
+
+        packet = _decode_frame(data, byte, length, fixed_header_length, copy, lazy, topic_cache, packet_pool)
+        if group:
+            packets.setdefault(packet.type, []).append(packet)
+        else:
+            packets.append(packet)
+        byte += fixed_header_length + length
+
+    return packets, byte
+
+
+def _decode_frame(
+        data: memoryview, offset: int, length: int, fixed_header_length: int, copy: bool, lazy: bool,
+        topic_cache: TopicCache = None, into: Packet | PacketPool = None
+):
+    # a field running past the end of the frame or a string that is not UTF-8 is a malformed packet
+    try:
+        return _decode_packet(data, offset, length, fixed_header_length, copy, lazy, topic_cache, into)
+    except (IndexError, UnicodeDecodeError, struct.error):
+        raise MalformedPacket
 
-    return fixed_header + _encode_vbi(len(bytedata)) + bytedata
 
+def _decode_packet(
+        data: memoryview, offset: int, length: int, fixed_header_length: int, copy: bool, lazy: bool,
+        topic_cache: TopicCache = None, into: Packet | PacketPool = None
+):
+    packet_type = (data[offset] >> 4) & 0b1111
 
-def decode(bytedata: bytes):
-    packet_type = (bytedata[0] >> 4) & 0b1111
-    packet = _PACKET_CLASS[packet_type]()
+    if lazy and packet_type == Type.PUBLISH:
+        frame = data[offset:offset + fixed_header_length + length]
+        return LazyPUBLISH(bytes(frame) if copy else frame, copy=copy, topic_cache=topic_cache)
+
+    # a reused instance only has the fields the decoder may leave untouched cleared
+    if isinstance(into, PacketPool):
+        into = into.acquire(packet_type)
+    if into is not None and type(into) is _PACKET_CLASS[packet_type]:
+        packet = into
+        _reset_packet(packet)
+    else:
+        packet = _PACKET_CLASS[packet_type]()
 
     if packet_type == Type.PUBLISH:
-        packet.DUP = bool((bytedata[0] >> 3) & 0b1)
-        packet.QoS = (bytedata[0] >> 1) & 0b11
-        packet.RETAIN = bool(bytedata[0] & 0b1)
+        packet.DUP = bool((data[offset] >> 3) & 0b1)
+        packet.QoS = (data[offset] >> 1) & 0b11
+        packet.RETAIN = bool(data[offset] & 0b1)
     else:
-        if (bytedata[0] & 0b1111) != packet.flag:
+        if (data[offset] & 0b1111) != packet.flag:
             raise MalformedPacket
 
-    length, size = _decode_vbi(bytedata[1:])
-    fixed_header_length = size + 1
-
-    packet_data = bytedata[fixed_header_length: fixed_header_length + length]
+    packet_data = data[offset + fixed_header_length: offset + fixed_header_length + length]
     byte = 0
 
     # Variable Header
     match packet.type:
         case Type.CONNECT:
-            protocol_name, size = _decode_utf8(packet_data[byte:])
+            protocol_name, size = _decode_utf8(packet_data, byte)
             byte += size
             if protocol_name != PROTOCOL_NAME:
                 raise MalformedPacket
-            protocol_version = _decode_b(packet_data[byte:])
+            protocol_version = _decode_b(packet_data, byte)
             byte += 1
             if protocol_version != PROTOCOL_VERSION:
                 raise MalformedPacket
@@ -826,210 +1652,456 @@ def decode(bytedata: bytes):
                 packet.will.QoS = (packet_data[byte] >> 3) & 0b11
             byte += 1
 
-            packet.keepAlive = _decode_b(packet_data[byte:], 2)
+            packet.keepAlive = _decode_b(packet_data, byte, 2)
             byte += 2
 
         case Type.CONNACK:
             packet.sessionPresent = bool(packet_data[byte] & 0b1)
             byte += 1
-            packet.reasonCode = _decode_b(packet_data[byte:])
+            packet.reasonCode = _decode_b(packet_data, byte)
             byte += 1
 
         case Type.PUBLISH:
-            packet.topic, size = _decode_utf8(packet_data[byte:])
+            packet.topic, size = _decode_topic(packet_data, byte, topic_cache)
             byte += size
             if packet.QoS in (1, 2):
-                packet.packetIdentifier, size = _decode_packet_identifier(packet_data[byte:])
+                packet.packetIdentifier, size = _decode_packet_identifier(packet_data, byte)
                 byte += size
 
         case (
             Type.PUBACK | Type.PUBREC | Type.PUBREL | Type.PUBCOMP |
             Type.SUBSCRIBE | Type.SUBACK | Type.UNSUBSCRIBE | Type.UNSUBACK
         ):
-            packet.packetIdentifier, size = _decode_packet_identifier(packet_data[byte:])
+            packet.packetIdentifier, size = _decode_packet_identifier(packet_data, byte)
             byte += size
 
+    # packets with reason code and properties not required
     if packet.type in (Type.PUBACK, Type.PUBREC, Type.PUBREL, Type.PUBCOMP, Type.DISCONNECT, Type.AUTH):
-        if length == 2:
-            packet.reasonCode = 0
+        if byte >= length:
+            packet.reasonCode = ReasonCode.SUCCESS
         else:
-            packet.reasonCode = _decode_b(packet_data[byte:])
+            packet.reasonCode = _decode_b(packet_data, byte)
             byte += 1
 
     # Properties
     if packet.type not in (Type.PINGREQ, Type.PINGRESP):
         if packet.type not in (
             Type.PUBACK, Type.PUBREC, Type.PUBREL, Type.PUBCOMP, Type.DISCONNECT, Type.AUTH
-        ) or length >= 4:
-            properties, size = _decode_properties(packet_data[byte:])
-            byte += size
-            _unpack_properties(packet, properties)
+        ) or byte < length:
+            byte += _decode_properties(packet, _PROPERTY_CODEC[packet.type], packet_data, byte, copy, topic_cache)
 
     # Payload
     match packet.type:
         case Type.CONNECT:
-            packet.clientID, size = _decode_utf8(packet_data[byte:])
+            packet.clientID, size = _decode_utf8(packet_data, byte)
             byte += size
 
             if packet.will is not None:
-                properties, size = _decode_properties(packet_data[byte:])
-                _unpack_properties(packet.will, properties)
+                byte += _decode_properties(packet.will, _WILL_PROPERTY_CODEC, packet_data, byte, copy, topic_cache)
+                packet.will.topic, size = _decode_topic(packet_data, byte, topic_cache)
                 byte += size
-                packet.will.topic, size = _decode_utf8(packet_data[byte:])
-                byte += size
-                packet.will.payload, size = _decode_bd(packet_data[byte:])
+                packet.will.payload, size = _decode_bd(packet_data, byte, copy)
                 byte += size
             if packet.username is not None:
-                packet.username, size = _decode_utf8(packet_data[byte:])
+                packet.username, size = _decode_utf8(packet_data, byte)
                 byte += size
             if packet.password is not None:
-                packet.password, size = _decode_bd(packet_data[byte:])
+                packet.password, size = _decode_bd(packet_data, byte, copy)
                 byte += size
 
         case Type.PUBLISH:
-            packet.payload = packet_data[byte:]
+            packet.payload = bytes(packet_data[byte:]) if copy else packet_data[byte:]
 
         case Type.SUBSCRIBE:
-            packet.subscriptions, _ = _decode_subscriptions(packet_data[byte:], length - byte)
+            packet.subscriptions, _ = _decode_subscriptions(packet_data, byte, length - byte, topic_cache)
 
         case Type.SUBACK | Type.UNSUBACK:
-            while byte < length:
-                packet.reasonCodes += (_decode_b(packet_data[byte:]),)
-                byte += 1
+            packet.reasonCodes = tuple(packet_data[byte:])
 
         case Type.UNSUBSCRIBE:
+            topics = []
             while byte < length:
-                topic, size = _decode_utf8(packet_data[byte:])
-                packet.topics += (topic,)
+                topic, size = _decode_topic(packet_data, byte, topic_cache)
+                topics.append(topic)
                 byte += size
+            packet.topics = tuple(topics)
 
-    return packet, fixed_header_length + length
+    return packet
+
+
+def _reset_packet(packet):
+    _PROPERTY_CODEC[packet.type].reset(packet)
+    match packet.type:
+        case Type.CONNECT:
+            packet.username = None
+            packet.password = None
+            packet.will = None
+        case Type.PUBLISH:
+            packet.packetIdentifier = 0
+
+
+def peek(bytedata: bytes | bytearray | memoryview, offset: int = 0, topic: bool = False) -> Header:
+    data = memoryview(bytedata)
+    length, fixed_header_length = _decode_remaining_length(data, offset)
+    header = Header(
+        packet_type=(data[offset] >> 4) & 0b1111, flag=data[offset] & 0b1111, remaining_length=length,
+        size=fixed_header_length + length
+    )
+
+    if header.type == Type.PUBLISH:
+        header.DUP = bool((header.flag >> 3) & 0b1)
+        header.QoS = (header.flag >> 1) & 0b11
+        header.RETAIN = bool(header.flag & 0b1)
+
+        # Variable Header
+        if topic:
+            byte = offset + fixed_header_length
+            end = byte + 2 + (2 if header.QoS in (1, 2) else 0)
+            if end > len(data):
+                raise IncompletePacket
+            topic_length = _decode_b(data, byte, 2)
+            if end + topic_length - byte > length:
+                raise MalformedPacket
+            if end + topic_length > len(data):
+                raise IncompletePacket
+            header.topic, size = _decode_utf8(data, byte)
+            byte += size
+            if header.QoS in (1, 2):
+                header.packetIdentifier, size = _decode_packet_identifier(data, byte)
+
+    return header
+
+
+def find_message_expiry(frame: bytes | bytearray | memoryview, offset: int = 0) -> int | None:
+    data = memoryview(frame)
+    length, byte = _decode_fixed_header(data, offset)
+    if (data[offset] >> 4) & 0b1111 != Type.PUBLISH:
+        raise MalformedPacket
+    byte += offset
+    end = byte + length
+
+    # Variable Header
+    byte += 2 + _decode_b(data, byte, 2)
+    if (data[offset] >> 1) & 0b11 in (1, 2):
+        byte += 2
+
+    # Properties, skipped by type until the Message Expiry Interval
+    properties_length, size = _decode_vbi(data, byte)
+    byte += size
+    properties_end = byte + properties_length
+    if properties_end > end:
+        raise MalformedPacket
+    while byte < properties_end:
+        identifier = data[byte]
+        byte += 1
+        if identifier == _PropertyIdentifier.MESSAGE_EXPIRY_INTERVAL:
+            return byte
+        match _PROPERTY_TYPE.get(identifier):
+            case _DataType.BYTE | _DataType.BOOLEAN:
+                byte += 1
+            case _DataType.TWO_BYTE_INTEGER:
+                byte += 2
+            case _DataType.FOUR_BYTE_INTEGER:
+                byte += 4
+            case _DataType.VARIABLE_BYTE_INTEGER:
+                byte += _decode_vbi(data, byte)[1]
+            case _DataType.UTF8_STRING | _DataType.BINARY_DATA:
+                byte += 2 + _decode_b(data, byte, 2)
+            case _DataType.UTF8_STRING_PAIR:
+                byte += 2 + _decode_b(data, byte, 2)
+                byte += 2 + _decode_b(data, byte, 2)
+            case _:
+                raise MalformedPacket
+    return None
 
 
-def _encode_properties(properties: tuple) -> bytes:
-    bytedata = bytes()
-    for value in properties:
-        bytedata += _encode_vbi(value.identifier)
-        bytedata += _PROPERTY_ENCODING[value.identifier](value.value)
-    return _encode_vbi(len(bytedata)) + bytedata
+def patch_message_expiry(frame: bytearray | memoryview, position: int, interval: int):
+    # the property is a fixed four bytes, so the remaining interval is written without a re-encode
+    _UINT[4].pack_into(frame, position, interval)
 
 
-def _encode_subscriptions(subscriptions: tuple) -> bytes:
-    bytedata = bytes()
+class StreamDecoder:
+    def __init__(
+            self, copy: bool = True, lazy: bool = False, topic_cache: TopicCache = None, pool: BufferPool = None,
+            packet_pool: PacketPool = None
+    ):
+        self.copy = copy
+        self.lazy = lazy
+        self.topicCache = topic_cache
+        self.pool = pool
+        self.packetPool = packet_pool
+        self._buffer = bytearray() if pool is None else None
+        self._length = 0
+
+    def feed(self, chunk: bytes | bytearray | memoryview) -> list:
+        if self.pool is not None:
+            return self._feed_pooled(chunk)
+
+        self._buffer += chunk
+        packets, offset = self._decode(self._buffer)
+        del self._buffer[:offset]
+        return packets
+
+    def pending(self) -> int:
+        return self._length if self.pool is not None else len(self._buffer)
+
+    def release(self):
+        # a partial frame left in a pooled buffer is discarded
+        if self.pool is not None and self._buffer is not None:
+            self.pool.release(self._buffer)
+            self._buffer = None
+        self._length = 0
+
+    def _feed_pooled(self, chunk: bytes | bytearray | memoryview) -> list:
+        length = self._length + len(chunk)
+        if self._buffer is None:
+            self._buffer = self.pool.acquire(length)
+        elif len(self._buffer) < length:
+            buffer = self.pool.acquire(length)
+            buffer[:self._length] = memoryview(self._buffer)[:self._length]
+            self.pool.release(self._buffer)
+            self._buffer = buffer
+        self._buffer[self._length:length] = chunk
+
+        with memoryview(self._buffer) as data:
+            packets, offset = self._decode(data[:length])
+
+        # keep the partial frame at the start, an empty buffer goes back to the pool between reads
+        self._length = length - offset
+        if self._length == 0:
+            self.pool.release(self._buffer)
+            self._buffer = None
+        elif offset:
+            # memoryview assignment is an overlap-safe move
+            with memoryview(self._buffer) as data:
+                data[:self._length] = data[offset:length]
+        return packets
+
+    def _decode(self, buffer: bytearray | memoryview) -> (list, int):
+        packets = []
+        offset = 0
+        with memoryview(buffer) as data:
+            while offset < len(data):
+                try:
+                    length, size = _decode_fixed_header(data, offset)
+                except IncompletePacket:
+                    break
+
+                if self.copy:
+                    packet = _decode_frame(
+                        data, offset, length, size, True, self.lazy, self.topicCache, self.packetPool
+                    )
+                else:
+                    # packet fields are views, keep them off the reusable buffer
+                    frame = memoryview(bytes(data[offset:offset + size + length]))
+                    packet = _decode_frame(
+                        frame, 0, length, size, False, self.lazy, self.topicCache, self.packetPool
+                    )
+                packets.append(packet)
+                offset += size + length
+
+        return packets, offset
+
+
+def _size_utf8(string: str) -> int:
+    return 2 + (len(string) if string.isascii() else len(string.encode()))
+
+
+def _size_bd(data: bytes) -> int:
+    return 2 + len(data)
+
+
+def _size_vbi(value: int) -> int:
+    if value < 128:
+        return 1
+    if value < 16384:
+        return 2
+    if value < 2097152:
+        return 3
+    return 4
+
+
+def _write_properties(
+        buffer: bytearray | memoryview, offset: int, codec: _PropertyCodec, obj, length: int,
+        topic_cache: TopicCache = None
+) -> int:
+    return codec.write(obj, buffer, _write_vbi(buffer, offset, length), topic_cache)
+
+
+def _write_subscriptions(
+        buffer: bytearray | memoryview, offset: int, subscriptions: tuple, topic_cache: TopicCache = None
+) -> int:
+    byte = offset
     for subscription in subscriptions:
-        bytedata += _encode_utf8(subscription.topic)
-        bytedata += _encode_b(
+        byte = _write_topic(buffer, byte, subscription.topic, topic_cache)
+        byte = _write_b(
+            buffer, byte,
             ((subscription.retainHandling & 0b11) << 4) +
             (int(subscription.RAP) << 3) +
             (int(subscription.NL) << 2) +
             (subscription.QoS & 0b11)
         )
-    return bytedata
+    return byte
+
 
+def _write_packet_identifier(buffer: bytearray | memoryview, offset: int, packet_identifier: int) -> int:
+    return _write_b(buffer, offset, packet_identifier, 2)
 
-def _encode_packet_identifier(packet_identifier: int) -> bytes:
-    return _encode_b(packet_identifier, 2)
 
+def _encode_utf8(string: str) -> bytes:
+    data = string.encode()
+    return len(data).to_bytes(2, 'big') + data
 
-def _encode_b(value: int, length: int = 1) -> bytes:
-    return int.to_bytes(value, length, 'big')
 
+def _write_b(buffer: bytearray | memoryview, offset: int, value: int, length: int = 1) -> int:
+    _UINT[length].pack_into(buffer, offset, value)
+    return offset + length
 
-def _encode_utf8(string: str) -> bytes:
-    return len(string).to_bytes(2, 'big') + string.encode()
 
+def _write_utf8(buffer: bytearray | memoryview, offset: int, string: str) -> int:
+    data = string.encode()
+    _UINT[2].pack_into(buffer, offset, len(data))
+    buffer[offset + 2:offset + 2 + len(data)] = data
+    return offset + 2 + len(data)
 
-def _encode_utf8_pair(key: str, value: str) -> bytes:
-    return _encode_utf8(key) + _encode_utf8(value)
 
+def _write_topic(buffer: bytearray | memoryview, offset: int, topic: str, topic_cache: TopicCache = None) -> int:
+    if topic_cache is None:
+        return _write_utf8(buffer, offset, topic)
+    data = topic_cache.encode(topic)
+    buffer[offset:offset + len(data)] = data
+    return offset + len(data)
 
-def _encode_bd(data: bytes) -> bytes:
-    return len(data).to_bytes(2, 'big') + data
 
+def _write_utf8_pair(buffer: bytearray | memoryview, offset: int, key: str, value: str) -> int:
+    return _write_utf8(buffer, _write_utf8(buffer, offset, key), value)
 
-def _encode_vbi(value: int) -> bytes:
-    bytedata = bytes()
+
+def _write_bd(buffer: bytearray | memoryview, offset: int, data: bytes) -> int:
+    _UINT[2].pack_into(buffer, offset, len(data))
+    buffer[offset + 2:offset + 2 + len(data)] = data
+    return offset + 2 + len(data)
+
+
+def _write_vbi(buffer: bytearray | memoryview, offset: int, value: int) -> int:
+    byte = offset
     while True:
-        byte = value % 128
+        digit = value % 128
         value //= 128
         if value > 0:
-            byte = byte | 128
-        bytedata += byte.to_bytes(1)
+            digit = digit | 128
+        buffer[byte] = digit
+        byte += 1
         if value <= 0:
             break
-    return bytedata
+    return byte
 
 
-def _decode_properties(bytedata: bytes) -> (tuple, int):
-    properties = ()
-    length, offset = _decode_vbi(bytedata)
-    byte = offset
-    while byte < length + offset:
-        property_id, size = _decode_vbi(bytedata[byte:])
-        value, value_size = _PROPERTY_DECODING[property_id](bytedata[byte + size:])
-        byte += size + value_size
+def _decode_fixed_header(bytedata: memoryview, offset: int = 0) -> (int, int):
+    length, size = _decode_remaining_length(bytedata, offset)
+    if offset + size + length > len(bytedata):
+        raise IncompletePacket
+    return length, size
 
-        properties += (_Property(property_id, value),)
 
-    return properties, byte
+def _decode_remaining_length(bytedata: memoryview, offset: int = 0) -> (int, int):
+    if offset >= len(bytedata):
+        raise IncompletePacket
+    try:
+        length, size = _decode_vbi(bytedata, offset + 1)
+    except IndexError:
+        raise IncompletePacket
+    return length, size + 1
+
+
+def _decode_properties(
+        obj, codec: _PropertyCodec, bytedata: memoryview, offset: int, copy: bool = True,
+        topic_cache: TopicCache = None
+) -> int:
+    length, size = _decode_vbi(bytedata, offset)
+    if offset + size + length > len(bytedata):
+        raise MalformedPacket
+    try:
+        codec.read(obj, bytedata, offset + size, offset + size + length, copy, topic_cache)
+    except struct.error:
+        raise MalformedPacket
+    return size + length
 
 
-def _decode_subscriptions(bytedata: bytes, length: int) -> (tuple, int):
-    subscriptions = ()
-    byte = 0
-    while byte < length:
-        topic, topic_len = _decode_utf8(bytedata[byte:])
-        options = _decode_b(bytedata[byte + topic_len:])
+def _decode_subscriptions(
+        bytedata: memoryview, offset: int, length: int, topic_cache: TopicCache = None
+) -> (tuple, int):
+    subscriptions = []
+    byte = offset
+    while byte < offset + length:
+        topic, topic_len = _decode_topic(bytedata, byte, topic_cache)
+        options = _decode_b(bytedata, byte + topic_len)
         byte += topic_len + 1
 
-        subscriptions += (
+        subscriptions.append(
             Subscription(
                 topic=topic,
                 qos=(options & 0b11),
                 nl=bool((options >> 2) & 0b1),
                 rap=bool((options >> 3) & 0b1),
                 retain_handling=((options >> 4) & 0b11)
-            ),
+            )
         )
 
-    return subscriptions, byte
+    return tuple(subscriptions), byte - offset
 
 
-def _decode_packet_identifier(bytedata: bytes) -> (int, int):
-    return _decode_b(bytedata, 2), 2
+def _decode_packet_identifier(bytedata: memoryview, offset: int = 0) -> (int, int):
+    return _decode_b(bytedata, offset, 2), 2
 
 
-def _decode_b(bytedata: bytes, length: int = 1) -> int:
-    return int.from_bytes(bytedata[:length], 'big', signed=False)
+def _decode_b(bytedata: memoryview, offset: int = 0, length: int = 1) -> int:
+    # a slice past the end is only shorter, a field that overruns the frame is caught here
+    if offset + length > len(bytedata):
+        raise MalformedPacket
+    return int.from_bytes(bytedata[offset:offset + length], 'big', signed=False)
 
 
-def _decode_utf8(bytedata: bytes) -> (str, int):
-    length = _decode_b(bytedata, 2)
-    return bytedata[2:length + 2].decode(), length + 2
+def _decode_utf8(bytedata: memoryview, offset: int = 0) -> (str, int):
+    length = _decode_b(bytedata, offset, 2)
+    if offset + length + 2 > len(bytedata):
+        raise MalformedPacket
+    return str(bytedata[offset + 2:offset + length + 2], 'utf-8'), length + 2
 
 
-def _decode_utf8_pair(bytedata: bytes) -> ((str, str), int):
-    key, key_len = _decode_utf8(bytedata)
-    value, value_len = _decode_utf8(bytedata[key_len:])
+def _decode_topic(bytedata: memoryview, offset: int = 0, topic_cache: TopicCache = None) -> (str, int):
+    if topic_cache is None:
+        return _decode_utf8(bytedata, offset)
+    length = _decode_b(bytedata, offset, 2)
+    if offset + length + 2 > len(bytedata):
+        raise MalformedPacket
+    return topic_cache.decode(bytedata[offset + 2:offset + length + 2]), length + 2
+
+
+def _decode_utf8_pair(bytedata: memoryview, offset: int = 0) -> ((str, str), int):
+    key, key_len = _decode_utf8(bytedata, offset)
+    value, value_len = _decode_utf8(bytedata, offset + key_len)
     return (key, value), key_len + value_len
 
 
-def _decode_bd(bytedata: bytes) -> (bytes, int):
-    length = _decode_b(bytedata, 2)
-    return bytedata[2: length + 2], length + 2
+def _decode_bd(bytedata: memoryview, offset: int = 0, copy: bool = False) -> (bytes | memoryview, int):
+    length = _decode_b(bytedata, offset, 2)
+    if offset + length + 2 > len(bytedata):
+        raise MalformedPacket
+    data = bytedata[offset + 2:offset + length + 2]
+    return bytes(data) if copy else data, length + 2
 
 
-def _decode_vbi(bytedata: bytes) -> (int, int):
+def _decode_vbi(bytedata: memoryview, offset: int = 0) -> (int, int):
     multiplier = 1
     value = 0
-    byte = 0
+    byte = offset
     while True:
         value += (bytedata[byte] & 127) * multiplier
         multiplier *= 128
         if not (bytedata[byte] & 128):
             break
         byte += 1
-    size = byte + 1
-    if size > 4:
-        raise MalformedPacket
-    return value, size
+        if byte - offset >= 4:
+            raise MalformedPacket
+    return value, byte - offset + 1
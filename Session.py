@@ -0,0 +1,284 @@
+from collections import OrderedDict, deque
+
+from Packets import (
+    PUBACK, PUBCOMP, PUBLISH, PUBREC, PUBREL, SUBACK, SUBSCRIBE, UNSUBACK, ProtocolError, QoSPacket, ReasonCode,
+    Type, encode_many
+)
+
+
+class TopicAliases:
+    __slots__ = ('outboundMaximum', 'inboundMaximum', 'minimumLength', '_outbound', '_inbound')
+
+    def __init__(self, outbound_maximum: int = 0, inbound_maximum: int = 0, minimum_length: int = 4):
+        # Topic Alias Maximum announced by the peer and by us
+        self.outboundMaximum = outbound_maximum or 0
+        self.inboundMaximum = inbound_maximum or 0
+
+        # topics shorter than this cost more as an alias property than they save
+        self.minimumLength = minimum_length
+
+        self._outbound = OrderedDict()
+        self._inbound = {}
+
+    def reset(self):
+        self._outbound.clear()
+        self._inbound.clear()
+
+    def outbound(self, packet: PUBLISH) -> PUBLISH:
+        topic = packet.topic
+        if self.outboundMaximum <= 0 or len(topic) < self.minimumLength:
+            packet.topicAlias = None
+            return packet
+
+        alias = self._outbound.get(topic)
+        if alias is not None:
+            self._outbound.move_to_end(topic)
+            packet.topic = ''
+            packet.topicAlias = alias
+            return packet
+
+        # the least recently used topic gives up its alias once all are taken
+        if len(self._outbound) < self.outboundMaximum:
+            alias = len(self._outbound) + 1
+        else:
+            _, alias = self._outbound.popitem(last=False)
+        self._outbound[topic] = alias
+
+        # the first PUBLISH carries both the topic and the alias to establish the mapping
+        packet.topicAlias = alias
+        return packet
+
+    def inbound(self, packet: PUBLISH) -> PUBLISH:
+        alias = packet.topicAlias
+        if alias is None:
+            if packet.topic == '':
+                raise ProtocolError(ReasonCode.PROTOCOL_ERROR)
+            return packet
+
+        if alias == 0 or alias > self.inboundMaximum:
+            raise ProtocolError(ReasonCode.TOPIC_ALIAS_INVALID)
+
+        if packet.topic == '':
+            try:
+                packet.topic = self._inbound[alias]
+            except KeyError:
+                raise ProtocolError(ReasonCode.PROTOCOL_ERROR)
+        else:
+            self._inbound[alias] = packet.topic
+
+        # aliases are scoped to the connection, the resolved packet can be forwarded as is
+        packet.topicAlias = None
+        return packet
+
+
+class PacketIdentifiersExhausted(Exception):
+    pass
+
+
+class PacketIdentifiers:
+    __slots__ = ('_words', '_free', '_count')
+
+    _WORD = 64
+    _FULL = (1 << 64) - 1
+
+    def __init__(self):
+        # one bit per identifier in 64 bit words, and one bit per word that still has a free identifier
+        self._words = [0] * (65536 // PacketIdentifiers._WORD)
+        self._free = (1 << len(self._words)) - 1
+        self._count = 0
+
+        # identifier 0 is not valid
+        self._words[0] = 1
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, identifier: int) -> bool:
+        return bool(self._words[identifier >> 6] >> (identifier & 63) & 1)
+
+    def allocate(self) -> int:
+        if not self._free:
+            raise PacketIdentifiersExhausted
+        index = (self._free & -self._free).bit_length() - 1
+        word = self._words[index]
+        free = ~word & PacketIdentifiers._FULL
+        bit = (free & -free).bit_length() - 1
+        self._set(index, word | (1 << bit))
+        return index << 6 | bit
+
+    def reserve(self, identifier: int) -> bool:
+        if not 0 < identifier < 65536 or identifier in self:
+            return False
+        index = identifier >> 6
+        self._set(index, self._words[index] | (1 << (identifier & 63)))
+        return True
+
+    def release(self, identifier: int) -> bool:
+        if not 0 < identifier < 65536 or identifier not in self:
+            return False
+        index = identifier >> 6
+        self._words[index] &= ~(1 << (identifier & 63))
+        self._free |= 1 << index
+        self._count -= 1
+        return True
+
+    def _set(self, index: int, word: int):
+        self._words[index] = word
+        if word == PacketIdentifiers._FULL:
+            self._free &= ~(1 << index)
+        self._count += 1
+
+
+class Inflight:
+    __slots__ = ('receiveMaximum', 'inboundMaximum', 'identifiers', '_outbound', '_pending', '_received')
+
+    def __init__(self, receive_maximum: int = None, inbound_maximum: int = None):
+        # Receive Maximum announced by the peer and by us, absent means 65535
+        self.receiveMaximum = receive_maximum or 65535
+        self.inboundMaximum = inbound_maximum or 65535
+
+        self.identifiers = PacketIdentifiers()
+
+        # identifier -> PUBLISH awaiting PUBACK or PUBREC, or PUBREL awaiting PUBCOMP, in send order
+        self._outbound = {}
+        self._pending = deque()
+
+        # QoS 2 identifiers received but not yet released by PUBREL
+        self._received = PacketIdentifiers()
+
+    def __len__(self) -> int:
+        return len(self._outbound)
+
+    def queued(self) -> int:
+        return len(self._pending)
+
+    def publish(self, packet: PUBLISH) -> PUBLISH | None:
+        if packet.QoS == 0:
+            return packet
+
+        # over the peer's Receive Maximum the PUBLISH waits for an acknowledgement
+        if len(self._outbound) >= self.receiveMaximum or self._pending:
+            self._pending.append(packet)
+            return None
+        return self._send(packet)
+
+    def acknowledge(self, packet: QoSPacket) -> list:
+        identifier = packet.packetIdentifier
+        sent = self._outbound.get(identifier)
+
+        if packet.type == Type.PUBREC:
+            if not isinstance(sent, PUBLISH) or sent.QoS != 2:
+                return [PUBREL(identifier, ReasonCode.PACKET_IDENTIFIER_NOT_FOUND)]
+            if packet.reasonCode is not None and packet.reasonCode >= ReasonCode.UNSPECIFIED_ERROR:
+                return self._complete(identifier)
+            release = self._outbound[identifier] = PUBREL(identifier)
+            return [release]
+
+        if packet.type == Type.PUBACK:
+            if not isinstance(sent, PUBLISH) or sent.QoS != 1:
+                return []
+        elif packet.type == Type.PUBCOMP:
+            if not isinstance(sent, PUBREL):
+                return []
+        else:
+            raise ProtocolError(ReasonCode.PROTOCOL_ERROR)
+        return self._complete(identifier)
+
+    def receive(self, packet: PUBLISH) -> tuple:
+        if packet.QoS == 0:
+            return True, None
+        if packet.QoS == 1:
+            return True, PUBACK(packet.packetIdentifier)
+
+        # a QoS 2 PUBLISH is delivered once, until the sender releases its identifier
+        if packet.packetIdentifier in self._received:
+            return False, PUBREC(packet.packetIdentifier)
+        if len(self._received) >= self.inboundMaximum:
+            raise ProtocolError(ReasonCode.RECEIVE_MAXIMUM_EXCEEDED)
+        self._received.reserve(packet.packetIdentifier)
+        return True, PUBREC(packet.packetIdentifier)
+
+    def release(self, packet: PUBREL) -> PUBCOMP:
+        if self._received.release(packet.packetIdentifier):
+            return PUBCOMP(packet.packetIdentifier)
+        return PUBCOMP(packet.packetIdentifier, ReasonCode.PACKET_IDENTIFIER_NOT_FOUND)
+
+    def discard(self, identifier: int) -> list:
+        # a PUBLISH that cannot be sent gives up its identifier and its place in the window
+        if not isinstance(self._outbound.get(identifier), PUBLISH):
+            return []
+        return self._complete(identifier)
+
+    def retransmit(self) -> list:
+        # on a resumed session unacknowledged PUBLISH packets are resent with DUP, PUBREL packets as they were
+        packets = []
+        for packet in self._outbound.values():
+            if isinstance(packet, PUBLISH):
+                packet.DUP = True
+            packets.append(packet)
+        return packets + self._admit()
+
+    def _send(self, packet: PUBLISH) -> PUBLISH:
+        packet.packetIdentifier = self.identifiers.allocate()
+        packet.DUP = False
+        self._outbound[packet.packetIdentifier] = packet
+        return packet
+
+    def _complete(self, identifier: int) -> list:
+        del self._outbound[identifier]
+        self.identifiers.release(identifier)
+        return self._admit()
+
+    def _admit(self) -> list:
+        packets = []
+        while self._pending and len(self._outbound) < self.receiveMaximum:
+            packets.append(self._send(self._pending.popleft()))
+        return packets
+
+
+class Batch:
+    __slots__ = ('packets', 'reasonCodes', '_identifiers', '_pending')
+
+    def __init__(self, packets: list, identifiers: PacketIdentifiers):
+        self.packets = packets
+
+        # per packet, the SUBACK or UNSUBACK reason codes in the order of its topic filters, None until acknowledged
+        self.reasonCodes = [None] * len(packets)
+
+        self._identifiers = identifiers
+        self._pending = {}
+        for index, packet in enumerate(packets):
+            packet.packetIdentifier = identifiers.allocate()
+            self._pending[packet.packetIdentifier] = index
+
+    def complete(self) -> bool:
+        return not self._pending
+
+    def encode(self) -> bytearray:
+        # coalesced, every packet is written into a single buffer
+        segments = encode_many(self.packets, coalesce=True)
+        return segments[0] if segments else bytearray()
+
+    def acknowledge(self, packet: SUBACK | UNSUBACK) -> bool:
+        index = self._pending.get(packet.packetIdentifier)
+        if index is None:
+            return False
+        sent = self.packets[index]
+
+        if isinstance(sent, SUBSCRIBE):
+            if packet.type != Type.SUBACK:
+                raise ProtocolError(ReasonCode.PROTOCOL_ERROR)
+            topics = [subscription.topic for subscription in sent.subscriptions]
+        else:
+            if packet.type != Type.UNSUBACK:
+                raise ProtocolError(ReasonCode.PROTOCOL_ERROR)
+            topics = sent.topics
+
+        # reason codes are in the order of the topic filters in the request
+        if len(packet.reasonCodes) != len(topics):
+            raise ProtocolError(ReasonCode.PROTOCOL_ERROR)
+        self.reasonCodes[index] = tuple(packet.reasonCodes)
+
+        del self._pending[packet.packetIdentifier]
+        self._identifiers.release(packet.packetIdentifier)
+        return True
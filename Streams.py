@@ -0,0 +1,131 @@
+import asyncio
+from collections import deque
+
+from Packets import (
+    BufferPool, IncompletePacket, PacketPool, StreamDecoder, TopicCache, decode_all, encode, encode_many, peek
+)
+
+
+class MQTTPacketStream:
+    def __init__(
+            self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, read_size: int = 65536,
+            copy: bool = True, lazy: bool = False, topic_cache: TopicCache = None, maximum_packet_size: int = None,
+            pool: BufferPool = None, packet_pool: PacketPool = None
+    ):
+        self.reader = reader
+        self.writer = writer
+        self.readSize = read_size
+        self.topicCache = topic_cache
+
+        # Maximum Packet Size announced by the peer
+        self.maximumPacketSize = maximum_packet_size
+
+        self._decoder = StreamDecoder(copy, lazy, topic_cache, pool, packet_pool)
+        self._packets = deque()
+
+    async def read_packet(self):
+        # a cancelled read loses nothing, partial frames stay in the decoder and decoded packets in the queue
+        while not self._packets:
+            chunk = await self.reader.read(self.readSize)
+            if not chunk:
+                if self._decoder.pending():
+                    raise IncompletePacket
+                raise EOFError
+            self._packets.extend(self._decoder.feed(chunk))
+        return self._packets.popleft()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.read_packet()
+        except EOFError:
+            raise StopAsyncIteration
+
+    async def write_packet(self, packet):
+        self.writer.write(encode(packet, self.topicCache, self.maximumPacketSize))
+        await self.writer.drain()
+
+    async def write_packets(self, packets):
+        self.writer.writelines(
+            encode_many(packets, topic_cache=self.topicCache, maximum_packet_size=self.maximumPacketSize)
+        )
+        await self.writer.drain()
+
+    async def close(self):
+        self._decoder.release()
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+class MQTTProtocol(asyncio.BufferedProtocol):
+    def __init__(
+            self, on_packet, buffer_size: int = 65536, minimum_read: int = 4096, copy: bool = True,
+            lazy: bool = False, topic_cache: TopicCache = None, packet_pool: PacketPool = None,
+            on_connection_lost=None
+    ):
+        # with copy=False packet fields are views on the receive buffer, valid only inside on_packet
+        self.onPacket = on_packet
+        self.onConnectionLost = on_connection_lost
+        self.minimumRead = minimum_read
+        self.copy = copy
+        self.lazy = lazy
+        self.topicCache = topic_cache
+        self.packetPool = packet_pool
+        self.transport = None
+
+        # unparsed bytes are buffer[start:end], the kernel writes after end
+        self._buffer = bytearray(max(buffer_size, minimum_read))
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+    def connection_made(self, transport: asyncio.BaseTransport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if len(self._buffer) - self._end < self.minimumRead:
+            self._compact()
+        return self._view[self._end:]
+
+    def buffer_updated(self, nbytes: int):
+        self._end += nbytes
+        packets, self._start = decode_all(
+            self._view[:self._end], self._start, self.copy, self.lazy, topic_cache=self.topicCache,
+            packet_pool=self.packetPool
+        )
+        if self._start == self._end:
+            self._start = 0
+            self._end = 0
+
+        for packet in packets:
+            self.onPacket(packet)
+
+    def eof_received(self):
+        return None
+
+    def connection_lost(self, exc: Exception | None):
+        self.transport = None
+        if self.onConnectionLost is not None:
+            self.onConnectionLost(exc)
+
+    def _compact(self):
+        pending = self._end - self._start
+        required = pending + self.minimumRead
+        if pending:
+            try:
+                required = max(required, peek(self._view[self._start:self._end]).size)
+            except IncompletePacket:
+                pass
+
+        # a frame larger than the buffer needs a bigger one, otherwise the partial frame moves to the front
+        if required > len(self._buffer):
+            buffer = bytearray(max(required, 2 * len(self._buffer)))
+            buffer[:pending] = self._view[self._start:self._end]
+            self._buffer = buffer
+            self._view = memoryview(buffer)
+        elif self._start:
+            self._view[:pending] = self._view[self._start:self._end]
+        self._start = 0
+        self._end = pending
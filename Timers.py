@@ -0,0 +1,208 @@
+import asyncio
+import heapq
+import math
+import time
+
+
+class TimingWheel:
+    __slots__ = ('resolution', '_bits', '_mask', '_wheels', '_where', '_tick', '_overflow')
+
+    def __init__(self, resolution: float = 1.0, bits: int = 6, levels: int = 4, now: float = 0.0):
+        self.resolution = resolution
+
+        # each level has 2**bits slots, a slot of level n spans 2**(bits * n) ticks
+        self._bits = bits
+        self._mask = (1 << bits) - 1
+        self._wheels = [[{} for _ in range(1 << bits)] for _ in range(levels)]
+
+        # key -> the slot holding it, so cancelling is a dict deletion
+        self._where = {}
+        self._tick = math.floor(now / resolution)
+        self._overflow = {}
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, key) -> bool:
+        return key in self._where
+
+    def schedule(self, key, deadline: float):
+        self.cancel(key)
+        # deadlines are rounded up to a tick so nothing fires early, one already due fires on the next tick
+        self._place(key, max(math.ceil(deadline / self.resolution), self._tick + 1))
+
+    def cancel(self, key) -> bool:
+        slot = self._where.pop(key, None)
+        if slot is None:
+            return False
+        del slot[key]
+        return True
+
+    def advance(self, now: float) -> list:
+        expired = []
+        target = math.floor(now / self.resolution)
+        while self._tick < target:
+            self._tick += 1
+            tick = self._tick
+
+            # when a level wraps, the next slot of the level above is redistributed first
+            levels = 0
+            while levels + 1 < len(self._wheels) and tick & ((1 << (self._bits * (levels + 1))) - 1) == 0:
+                levels += 1
+            if levels == len(self._wheels) - 1 and tick & ((1 << (self._bits * len(self._wheels))) - 1) == 0:
+                self._cascade(self._overflow)
+            for level in range(levels, 0, -1):
+                self._cascade(self._wheels[level][(tick >> (self._bits * level)) & self._mask])
+
+            slot = self._wheels[0][tick & self._mask]
+            for key in slot:
+                del self._where[key]
+            expired.extend(slot)
+            slot.clear()
+        return expired
+
+    def _cascade(self, slot: dict):
+        entries = list(slot.items())
+        slot.clear()
+        for key, tick in entries:
+            del self._where[key]
+            self._place(key, tick)
+
+    def _place(self, key, tick: int):
+        for level, wheel in enumerate(self._wheels):
+            shift = self._bits * level
+            if (tick >> shift) - (self._tick >> shift) <= self._mask:
+                slot = wheel[(tick >> shift) & self._mask]
+                break
+        else:
+            slot = self._overflow
+        slot[key] = tick
+        self._where[key] = slot
+
+
+class ExpiryIndex:
+    __slots__ = ('resolution', '_buckets', '_heap', '_count')
+
+    def __init__(self, resolution: float = 1.0):
+        self.resolution = resolution
+
+        # tick -> keys expiring in it, and a heap of the ticks that have a bucket
+        self._buckets = {}
+        self._heap = []
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, key, deadline: float):
+        # a key expires within one resolution after its deadline, never before
+        tick = math.ceil(deadline / self.resolution)
+        bucket = self._buckets.get(tick)
+        if bucket is None:
+            bucket = self._buckets[tick] = []
+            heapq.heappush(self._heap, tick)
+        bucket.append(key)
+        self._count += 1
+
+    def expire(self, now: float) -> list:
+        # keys are not removed on delivery, callers skip the ones that are no longer queued
+        expired = []
+        tick = math.floor(now / self.resolution)
+        while self._heap and self._heap[0] <= tick:
+            expired.extend(self._buckets.pop(heapq.heappop(self._heap)))
+        self._count -= len(expired)
+        return expired
+
+    def next_deadline(self) -> float | None:
+        return self._heap[0] * self.resolution if self._heap else None
+
+
+class _KeepAliveState:
+    __slots__ = ('keepAlive', 'ping', 'received', 'sent')
+
+    def __init__(self, keep_alive: int, ping: bool, now: float):
+        self.keepAlive = keep_alive
+        self.ping = ping
+        self.received = now
+        self.sent = now
+
+
+class KeepAlive:
+    _TIMEOUT = 0
+    _PING = 1
+
+    def __init__(self, on_timeout, on_ping=None, resolution: float = 1.0, clock=time.monotonic):
+        # callbacks get every connection that expired in a tick at once
+        self.onTimeout = on_timeout
+        self.onPing = on_ping
+        self._clock = clock
+        self._now = clock()
+        self._wheel = TimingWheel(resolution, now=self._now)
+        self._connections = {}
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    def add(self, key, keep_alive: int, ping: bool = False, now: float = None):
+        self.remove(key)
+        if not keep_alive:
+            return
+        now = self._clock() if now is None else now
+        self._connections[key] = _KeepAliveState(keep_alive, ping, now)
+
+        # the peer is disconnected after one and a half Keep Alive periods without a packet
+        self._wheel.schedule((key, KeepAlive._TIMEOUT), now + 1.5 * keep_alive)
+        if ping:
+            self._wheel.schedule((key, KeepAlive._PING), now + keep_alive)
+
+    def remove(self, key):
+        if self._connections.pop(key, None) is not None:
+            self._wheel.cancel((key, KeepAlive._TIMEOUT))
+            self._wheel.cancel((key, KeepAlive._PING))
+
+    def received(self, key, now: float = None):
+        # only a timestamp per packet, the wheel entry is moved when it comes due
+        state = self._connections.get(key)
+        if state is not None:
+            # the time the packet arrived, the last tick can be up to one resolution earlier
+            state.received = self._clock() if now is None else now
+
+    def sent(self, key, now: float = None):
+        state = self._connections.get(key)
+        if state is not None:
+            state.sent = self._clock() if now is None else now
+
+    def tick(self, now: float = None):
+        self._now = self._clock() if now is None else now
+        timeouts = []
+        pings = []
+        for key, kind in self._wheel.advance(self._now):
+            state = self._connections.get(key)
+            if state is None:
+                continue
+
+            if kind == KeepAlive._TIMEOUT:
+                deadline = state.received + 1.5 * state.keepAlive
+                if deadline <= self._now:
+                    timeouts.append(key)
+                    continue
+            else:
+                deadline = state.sent + state.keepAlive
+                if deadline <= self._now:
+                    # the PINGREQ counts as a sent packet
+                    pings.append(key)
+                    state.sent = self._now
+                    deadline = self._now + state.keepAlive
+            self._wheel.schedule((key, kind), deadline)
+
+        for key in timeouts:
+            self.remove(key)
+        if timeouts:
+            self.onTimeout(timeouts)
+        if pings and self.onPing is not None:
+            self.onPing([key for key in pings if key in self._connections])
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self._wheel.resolution)
+            self.tick()
@@ -0,0 +1,86 @@
+import argparse
+import functools
+import os
+import subprocess
+import sys
+import timeit
+import tracemalloc
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import Packets  # noqa: E402
+
+
+CASES = {
+    'CONNECT': lambda P: P.CONNECT(client_id='client', keep_alive=60, session_expiry_interval=3600),
+    'CONNACK': lambda P: P.CONNACK(receive_maximum=100, topic_alias_maximum=10),
+    'PUBLISH': lambda P: P.PUBLISH(topic='sensors/a/temperature', payload=b'21.5', packet_identifier=1, qos=1),
+    'PUBACK': lambda P: P.PUBACK(packet_identifier=1),
+    'SUBSCRIBE': lambda P: P.SUBSCRIBE(P.Subscription('sensors/#', 1), packet_identifier=1),
+    'Will': lambda P: P.Will(topic='clients/a/status', payload=b'offline'),
+    'Subscription': lambda P: P.Subscription('sensors/+/temperature', 1),
+}
+
+
+def load_revision(revision: str) -> types.ModuleType:
+    source = subprocess.run(
+        ['git', 'show', f'{revision}:Packets.py'], cwd=ROOT, capture_output=True, check=True
+    ).stdout
+    module = types.ModuleType(f'Packets@{revision}')
+    exec(compile(source, f'Packets.py@{revision}', 'exec'), module.__dict__)
+    return module
+
+
+def instance_memory(factory, count: int) -> float:
+    instances = [None] * count
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for index in range(count):
+        instances[index] = factory()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / count
+
+
+def construction_time(factory, count: int) -> float:
+    return min(timeit.repeat(factory, number=count, repeat=5)) / count * 1e9
+
+
+def measure(module: types.ModuleType, count: int) -> dict:
+    results = {}
+    for name, case in CASES.items():
+        if not hasattr(module, name):
+            continue
+        factory = functools.partial(case, module)
+        results[name] = (instance_memory(factory, count), construction_time(factory, count))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-instance memory and construction time of packet classes')
+    parser.add_argument('--count', type=int, default=100000, help='instances created per class')
+    parser.add_argument('--baseline', help='git revision to compare against, e.g. HEAD~1')
+    arguments = parser.parse_args()
+
+    current = measure(Packets, arguments.count)
+    baseline = measure(load_revision(arguments.baseline), arguments.count) if arguments.baseline else {}
+
+    print(f'{"class":<14}{"bytes":>10}{"ns":>10}{"base bytes":>12}{"base ns":>10}{"saved":>8}')
+    for name, (memory, duration) in current.items():
+        line = f'{name:<14}{memory:>10.0f}{duration:>10.0f}'
+        if name in baseline:
+            base_memory, base_duration = baseline[name]
+            line += f'{base_memory:>12.0f}{base_duration:>10.0f}{1 - memory / base_memory:>8.0%}'
+        print(line)
+
+    # slotted classes must not regain a per-instance __dict__
+    regressions = [name for name, case in CASES.items() if hasattr(case(Packets), '__dict__')]
+    if regressions:
+        print(f'instances with __dict__: {", ".join(regressions)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from Broker import SubscriptionTrie  # noqa: E402
+from Packets import Subscription  # noqa: E402
+
+
+def topic_filters(count: int, rng: random.Random) -> list:
+    filters = []
+    for index in range(count):
+        site, device = index % 1000, index // 1000
+        match index % 10:
+            case 0:
+                filters.append(f'site/{site}/+/status')
+            case 1:
+                filters.append(f'site/{site}/device/{device}/#')
+            case _:
+                filters.append(f'site/{site}/device/{device}/sensor/{rng.randrange(16)}')
+    return filters
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SubscriptionTrie insert and match throughput')
+    parser.add_argument('--filters', type=int, default=1000000, help='number of subscriptions')
+    parser.add_argument('--topics', type=int, default=100000, help='number of topics matched')
+    arguments = parser.parse_args()
+
+    rng = random.Random(0)
+    filters = topic_filters(arguments.filters, rng)
+    trie = SubscriptionTrie()
+
+    start = time.perf_counter()
+    for index, topic_filter in enumerate(filters):
+        trie.subscribe(f'client-{index}', Subscription(topic_filter, index % 3))
+    elapsed = time.perf_counter() - start
+    print(f'insert  {len(trie)} filters in {elapsed:.2f}s ({elapsed / len(trie) * 1e6:.2f} us/filter)')
+
+    topics = []
+    for _ in range(arguments.topics):
+        index = rng.randrange(arguments.filters)
+        topics.append(f'site/{index % 1000}/device/{index // 1000}/sensor/{rng.randrange(16)}')
+    matched = 0
+    start = time.perf_counter()
+    for topic in topics:
+        matched += len(trie.match(topic))
+    elapsed = time.perf_counter() - start
+    print(
+        f'match   {len(topics)} topics in {elapsed:.2f}s ({elapsed / len(topics) * 1e6:.2f} us/topic, '
+        f'{matched / len(topics):.1f} subscribers/topic)'
+    )
+
+    start = time.perf_counter()
+    for index, topic_filter in enumerate(filters):
+        trie.unsubscribe(f'client-{index}', topic_filter)
+    elapsed = time.perf_counter() - start
+    print(f'remove  {len(filters)} filters in {elapsed:.2f}s ({elapsed / len(filters) * 1e6:.2f} us/filter)')
+
+
+if __name__ == '__main__':
+    main()